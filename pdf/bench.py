@@ -0,0 +1,203 @@
+# Benchmark pdfconduit operations across the PDF libraries that implement them
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+from argparse import ArgumentParser
+from glob import glob
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen.canvas import Canvas
+
+from pdf.conduit import Encrypt, Watermark, WatermarkAdd
+from pdf.convert import Flatten, PDF2IMG
+from pdf.transform import Merge, rotate, upscale
+from pdf.utils import Info
+from pdf.utils.memory import memory_usage, peak_memory_usage
+
+
+# Methods implemented by each benchmarked operation
+OPERATIONS = {
+    'watermark': ('pdfrw', 'pypdf3', 'fitz', 'stream'),
+    'merge': ('pdfrw', 'pypdf3', 'stream'),
+    'rotate': ('pdfrw', 'pypdf3', 'incremental'),
+    'upscale': ('pdfrw', 'pypdf3', 'fit'),
+    'encrypt': ('pypdf3', 'fitz'),
+    'pdf2img': ('fitz',),
+    'flatten': ('fitz',),
+}
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'data')
+
+
+def synthetic_pdf(pages, output):
+    """Generate a letter sized PDF document with text and vector graphics on every page."""
+    canvas = Canvas(output, pagesize=letter)
+    width, height = letter
+    for page in range(pages):
+        canvas.setFont('Helvetica-Bold', 18)
+        canvas.drawString(72, height - 72, 'pdfconduit benchmark page {0} of {1}'.format(page + 1, pages))
+        canvas.setFont('Helvetica', 10)
+        for line in range(40):
+            canvas.drawString(72, height - 100 - line * 14, 'Lorem ipsum dolor sit amet ' * 3)
+        for i in range(10):
+            canvas.rect(72 + i * 45, 72, 40, 40, fill=i % 2)
+        canvas.showPage()
+    canvas.save()
+    return output
+
+
+def _run(operation, method, document, workdir, watermark):
+    """Execute one operation and return the output file path(s)."""
+    name = os.path.splitext(os.path.basename(document))[0]
+    output = os.path.join(workdir, '{0}_{1}_{2}.pdf'.format(name, operation, method))
+    if operation == 'watermark':
+        return WatermarkAdd(document, watermark, output=output, method=method).file
+    elif operation == 'merge':
+        return Merge([document, document], output_name=os.path.basename(output), output_dir=workdir,
+                     method=method).file
+    elif operation == 'rotate':
+        return rotate(document, 90, tempdir=workdir, method=method)
+    elif operation == 'upscale':
+        return upscale(document, scale=1.5, tempdir=workdir, method=method)
+    elif operation == 'encrypt':
+        return Encrypt(document, 'foo', 'baz', output=output, method=method).file
+    elif operation == 'pdf2img':
+        imgs = os.path.join(workdir, '{0}_{1}'.format(name, operation))
+        os.makedirs(imgs, exist_ok=True)
+        return PDF2IMG(document, tempdir=imgs).save()
+    elif operation == 'flatten':
+        return Flatten(document, suffix='flat_' + method).save()
+
+
+def _size(output):
+    if isinstance(output, (list, tuple)):
+        return sum(_size(o) for o in output)
+    return os.path.getsize(output) if output and os.path.isfile(output) else 0
+
+
+def measure(operation, method, document, workdir, watermark=None):
+    """
+    Time one operation and measure its memory use and output size.
+
+    Peak RSS covers the life of the calling process, call from a fresh process (as benchmark()
+    does when isolate is True) to attribute it to a single operation.
+
+    :return: dict
+    """
+    pages = Info(document).pages * (2 if operation == 'merge' else 1)
+    result = {'operation': operation, 'method': method, 'document': os.path.basename(document), 'pages': pages,
+              'baseline_rss_mb': memory_usage()}
+    try:
+        start = perf_counter()
+        output = _run(operation, method, document, workdir, watermark)
+        result['seconds'] = perf_counter() - start
+        result['pages_per_second'] = pages / result['seconds'] if result['seconds'] else None
+        result['output_bytes'] = _size(output)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    result['peak_rss_mb'] = peak_memory_usage()
+    return result
+
+
+def _measure(args):
+    return measure(*args)
+
+
+def _best(results):
+    """Combine repeated measurements of a case, keeping the fastest time and highest memory peak."""
+    ok = [r for r in results if 'error' not in r]
+    if not ok:
+        return results[0]
+    best = dict(min(ok, key=lambda r: r['seconds']))
+    peaks = [r['peak_rss_mb'] for r in ok if r['peak_rss_mb'] is not None]
+    best['peak_rss_mb'] = max(peaks) if peaks else None
+    best['repeat'] = len(results)
+    return best
+
+
+def benchmark(documents=None, pages=(10, 100), operations=None, methods=None, repeat=1, isolate=True):
+    """
+    Benchmark pdfconduit operations across every method that implements them.
+
+    :param documents: List of PDF document paths (documents in tests/data by default)
+    :param pages: Page counts of synthetically generated documents
+    :param operations: Operations to benchmark (all in OPERATIONS by default)
+    :param methods: Methods to benchmark (all available by default)
+    :param repeat: Number of times each case is run, the fastest run is reported
+    :param isolate: Run each case in a fresh process so peak RSS is per case
+    :return: dict
+        Environment information and a list of results
+    """
+    documents = sorted(glob(os.path.join(TEST_DATA, '*.pdf'))) if documents is None else documents
+    operations = operations or list(OPERATIONS)
+
+    with TemporaryDirectory() as workdir:
+        # Copy documents so operations that write next to their source don't write to tests/data
+        inputs = []
+        for document in documents:
+            inputs.append(shutil.copy(document, os.path.join(workdir, os.path.basename(document))))
+        for count in pages:
+            inputs.append(synthetic_pdf(count, os.path.join(workdir, 'synthetic_{0}.pdf'.format(count))))
+
+        watermark = None
+        if 'watermark' in operations and inputs:
+            wm = Watermark(inputs[0], use_receipt=False, open_file=False, tempdir=workdir, remove_temps=False)
+            watermark = wm.draw(text1='pdfconduit', text2='benchmark', copyright=True, rotate=30, opacity=0.08)
+
+        cases = [(operation, method, document, workdir, watermark)
+                 for operation in operations
+                 for method in OPERATIONS[operation] if not methods or method in methods
+                 for document in inputs]
+        runs = [case for case in cases for _ in range(repeat)]
+
+        if isolate:
+            # A new worker process per case
+            with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+                measured = pool.map(_measure, runs, chunksize=1)
+        else:
+            measured = [_measure(case) for case in runs]
+
+    results = [_best(measured[i:i + repeat]) for i in range(0, len(measured), repeat)]
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'versions': _versions(),
+            'results': results}
+
+
+def _versions():
+    versions = {}
+    for package in ('PyPDF3', 'pdfrw', 'fitz', 'reportlab', 'PIL'):
+        try:
+            module = __import__(package)
+            versions[package] = getattr(module, 'VersionBind', None) or getattr(module, '__version__', None)
+        except ImportError:
+            versions[package] = None
+    return versions
+
+
+def main():
+    ap = ArgumentParser(description='Benchmark pdfconduit operations across PDF libraries.')
+    ap.add_argument('-d', '--documents', nargs='*', help='PDF documents to benchmark (default: tests/data)')
+    ap.add_argument('-p', '--pages', nargs='*', type=int, default=[10, 100],
+                    help='Page counts of synthetically generated documents')
+    ap.add_argument('-o', '--operations', nargs='*', choices=list(OPERATIONS), help='Operations to benchmark')
+    ap.add_argument('-m', '--methods', nargs='*', help='Methods to benchmark')
+    ap.add_argument('-r', '--repeat', type=int, default=1, help='Runs per case, fastest is reported')
+    ap.add_argument('--no-isolate', action='store_true', help='Run every case in this process')
+    ap.add_argument('--output', help='JSON output file (default: stdout)')
+    args = ap.parse_args()
+
+    report = benchmark(args.documents, args.pages, args.operations, args.methods, args.repeat,
+                       not args.no_isolate)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
-from pdf.conduit.encrypt import Encrypt
-from pdf.conduit.watermark import WatermarkAdd, Watermark, Label
+from pdf.conduit.encrypt import Encrypt, encrypt_recipients
+from pdf.conduit.watermark import WatermarkAdd, Watermark, WatermarkCache, Label, watermark_batch
 
 
-__all__ = ["Encrypt", "Watermark", "Label", "WatermarkAdd"]
+__all__ = ["Encrypt", "Watermark", "Label", "WatermarkAdd", "WatermarkCache", "watermark_batch", "encrypt_recipients"]
@@ -1,61 +1,320 @@
 # Encrypt a PDF file with password protection
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import fitz
 from PyPDF3 import PdfFileWriter
+from PyPDF3.generic import NullObject
+
+from pdf.utils import add_suffix, pypdf3_reader, pypdf3_write, fitz_reader
+
+
+METADATA = {
+    '/Producer': 'pdfconduit',
+    '/Creator': 'HPA Design',
+    '/Author': 'HPA Design',
+}
+
+
+# Encryption algorithms supported by PyMuPDF, PyPDF3 only supports RC4
+ALGORITHMS = {
+    'rc4-40': fitz.PDF_ENCRYPT_RC4_40,
+    'rc4-128': fitz.PDF_ENCRYPT_RC4_128,
+    'aes-128': fitz.PDF_ENCRYPT_AES_128,
+    'aes-256': fitz.PDF_ENCRYPT_AES_256,
+}
+
+
+def algorithm_name(algorithm=None, bit128=True):
+    """Retrieve a normalized encryption algorithm name, RC4 with a key size set by bit128 by default."""
+    if algorithm is None:
+        return 'rc4-128' if bit128 else 'rc4-40'
+    name = algorithm.lower().replace('_', '-')
+    if name not in ALGORITHMS:
+        raise ValueError('Unsupported encryption algorithm {0!r}, choose one of: {1}'.format(
+            algorithm, ', '.join(ALGORITHMS)))
+    return name
+
+
+def is_aes(algorithm):
+    return algorithm is not None and algorithm_name(algorithm).startswith('aes')
+
+
+def permissions(allow_printing=True, allow_commenting=False, overwrite_permission=None):
+    """Retrieve the /P permission flag value PyPDF3 applies for a set of permissions."""
+    if overwrite_permission is not None:
+        return int(overwrite_permission)
+    elif allow_printing:
+        return -1500 if allow_commenting else -1852
+    else:
+        return -800 if allow_commenting else 0
+
+
+def clone_writer(pdf_reader):
+    """
+    Create a PdfFileWriter object that copies a reader's document root wholesale.
+
+    Outlines, named destinations, AcroForm fields and every other catalog entry are preserved,
+    pages are copied when the writer walks the document root while writing.
+    """
+    pdf_writer = PdfFileWriter()
+    pdf_writer.cloneReaderDocumentRoot(pdf_reader)
+
+    # The writer's own (empty) page tree is no longer referenced
+    pdf_writer._objects[pdf_writer._pages.idnum - 1] = NullObject()
+    return pdf_writer
+
+
+def encrypt_writer(pdf_writer, user_pw, owner_pw=None, bit128=True, allow_printing=True, allow_commenting=False,
+                   overwrite_permission=None, algorithm=None):
+    """Apply RC4 encryption and document metadata to a PdfFileWriter object before it's written."""
+    algorithm = algorithm_name(algorithm, bit128)
+    if is_aes(algorithm):
+        raise ValueError('PyPDF3 does not support {0} encryption, use the fitz method'.format(algorithm))
+    pdf_writer.encrypt(user_pw, owner_pw, use_128bit=algorithm == 'rc4-128', allow_printing=allow_printing,
+                       allow_commenting=allow_commenting, overwrite_permission=overwrite_permission)
+
+    # todo: add metadata adding functionality
+    pdf_writer.addMetadata(METADATA)
+    return pdf_writer
+
+
+def encrypt_fitz(doc, user_pw, owner_pw=None, bit128=True, allow_printing=True, allow_commenting=False,
+                 overwrite_permission=None, algorithm=None):
+    """
+    Apply document metadata to a PyMuPDF Document and retrieve the save() arguments that encrypt it.
 
-from pdf.utils import add_suffix, pypdf3_reader
+    Permissions match those applied by encrypt_writer(), the algorithm may also be 'aes-128' or 'aes-256'.
+    """
+    doc.setMetadata(dict(doc.metadata, **{k[1:].lower(): v for k, v in METADATA.items()}))
+    return {
+        'encryption': ALGORITHMS[algorithm_name(algorithm, bit128)],
+        'user_pw': user_pw,
+        'owner_pw': owner_pw if owner_pw is not None else user_pw,
+        'permissions': permissions(allow_printing, allow_commenting, overwrite_permission),
+    }
 
 
 class Encrypt:
     def __init__(self, pdf, user_pw, owner_pw=None, output=None, suffix='secured', bit128=True, allow_printing=True,
                  allow_commenting=False, overwrite_permission=None, progress_bar_enabled=False, progress_bar='gui',
-                 decrypt=None):
-        """Password protect PDF file and allow all other permissions."""
+                 decrypt=None, in_memory=False, method='pypdf3', algorithm=None, clone=False):
+        """
+        Password protect PDF file and allow all other permissions.
+
+        `pdf` may be a file path or an in-memory stream.  When in_memory is True and no output
+        is specified the encrypted PDF is written to an io.BytesIO stream.
+
+        The 'pypdf3' method encrypts with RC4 in pure Python, 40 or 128 bit keys depending on
+        bit128.  The 'fitz' method encrypts while saving in C using PyMuPDF and also supports
+        AES, `algorithm` may be 'rc4-40', 'rc4-128', 'aes-128' or 'aes-256' (AES algorithms
+        always use the 'fitz' method).
+
+        When clone is True the 'pypdf3' method copies the document root wholesale rather than
+        adding pages one by one, preserving outlines, named destinations and forms (the 'fitz'
+        method always preserves document structure).
+        """
         self.pdf = pdf
         self.user_pw = user_pw
         self.owner_pw = owner_pw
-        self.output = add_suffix(pdf, suffix=suffix) if not output else output
+        if output:
+            self.output = output
+        elif in_memory:
+            self.output = BytesIO()
+        else:
+            self.output = add_suffix(pdf, suffix=suffix)
         self.encrypt_128 = bit128
         self.allow_printing = allow_printing
         self.allow_commenting = allow_commenting
         self.overwrite_permission = overwrite_permission
         self.progress_bar_enabled = progress_bar_enabled
         self.progress_bar = progress_bar
+        self.clone = clone
+        self.algorithm = algorithm_name(algorithm, bit128)
+        self.method = 'fitz' if is_aes(self.algorithm) else method
 
-        self.encrypt(decrypt)
+        if self.method == 'fitz':
+            self.encrypt_fitz(decrypt)
+        else:
+            self.encrypt(decrypt)
 
     def __str__(self):
         return str(self.output)
 
+    @property
+    def file(self):
+        return self.output if hasattr(self.output, 'read') else str(self.output)
+
     def encrypt(self, decrypt=None):
-        # Create PDF writer object
-        pdf_writer = PdfFileWriter()
-        with open(self.pdf, 'rb') as pdf_file:
+        pdf_file = self.pdf if hasattr(self.pdf, 'read') else open(self.pdf, 'rb')
+        try:
             # Read opened PDF file
             pdf_reader = pypdf3_reader(pdf_file, decrypt)
 
-            # Add each page from source PDF
-            for page_num in range(pdf_reader.numPages):
-                page = pdf_reader.getPage(page_num)
-                pdf_writer.addPage(page)
+            if self.clone:
+                # Copy the source PDF's document root
+                pdf_writer = clone_writer(pdf_reader)
+            else:
+                # Create PDF writer object and add each page from source PDF
+                pdf_writer = PdfFileWriter()
+                for page_num in range(pdf_reader.numPages):
+                    page = pdf_reader.getPage(page_num)
+                    pdf_writer.addPage(page)
 
             # Apply encryption to writer object
-            pdf_writer.encrypt(self.user_pw, self.owner_pw, use_128bit=self.encrypt_128,
-                               allow_printing=self.allow_printing, allow_commenting=self.allow_commenting,
-                               overwrite_permission=self.overwrite_permission)
+            encrypt_writer(pdf_writer, self.user_pw, self.owner_pw, allow_printing=self.allow_printing,
+                           allow_commenting=self.allow_commenting, overwrite_permission=self.overwrite_permission,
+                           algorithm=self.algorithm)
 
-            # todo: add metadata adding functionality
-            pdf_writer.addMetadata({
-                '/Producer': 'pdfconduit',
-                '/Creator': 'HPA Design',
-                '/Author': 'HPA Design',
-            })
+            # Write encrypted PDF to file
+            pypdf3_write(pdf_writer, self.output, progress_bar=self.progress_bar,
+                         progress_bar_enabled=self.progress_bar_enabled)
+        finally:
+            if pdf_file is not self.pdf:
+                pdf_file.close()
+        return self.output
+
+    def encrypt_fitz(self, decrypt=None):
+        """Encrypt while saving using PyMuPDF, pages are not copied to a new document."""
+        doc = fitz_reader(self.pdf)
+        try:
+            if decrypt:
+                doc.authenticate(decrypt)
+            options = encrypt_fitz(doc, self.user_pw, self.owner_pw, allow_printing=self.allow_printing,
+                                   allow_commenting=self.allow_commenting,
+                                   overwrite_permission=self.overwrite_permission, algorithm=self.algorithm)
 
             # Write encrypted PDF to file
-            with open(self.output, 'wb') as output_pdf:
-                pdf_writer.write(output_pdf, progress_bar=self.progress_bar,
-                                 progress_bar_enabled=self.progress_bar_enabled)
+            if hasattr(self.output, 'write'):
+                self.output.write(doc.write(**options))
+                self.output.seek(0)
+            else:
+                doc.save(self.output, **options)
+        finally:
+            doc.close()
         return self.output
 
 
+# Keyword arguments of a recipient tuple, in order
+RECIPIENT_FIELDS = ('user_pw', 'owner_pw', 'allow_printing', 'allow_commenting')
+
+
+def _recipient(recipient, algorithm=None):
+    """Retrieve a recipient's encryption arguments from a tuple or dictionary."""
+    if isinstance(recipient, dict):
+        recipient = dict(recipient)
+    elif isinstance(recipient, str):
+        recipient = {'user_pw': recipient}
+    else:
+        recipient = dict(zip(RECIPIENT_FIELDS, recipient))
+    recipient.setdefault('algorithm', algorithm)
+    return recipient
+
+
+def _encrypt_recipients(job):
+    """Parse a document once and write one encrypted copy per recipient."""
+    pdf, decrypt, method, clone, recipients = job
+    pdf = BytesIO(pdf) if isinstance(pdf, bytes) else pdf
+    written = []
+    if method == 'fitz':
+        doc = fitz_reader(pdf)
+        try:
+            if decrypt:
+                doc.authenticate(decrypt)
+            for output, recipient in recipients:
+                options = encrypt_fitz(doc, **recipient)
+                if output is None:
+                    written.append(doc.write(**options))
+                else:
+                    doc.save(output, **options)
+                    written.append(output)
+        finally:
+            doc.close()
+    else:
+        pdf_file = pdf if hasattr(pdf, 'read') else open(pdf, 'rb')
+        try:
+            pdf_reader = pypdf3_reader(pdf_file, decrypt)
+
+            # A new writer per recipient, the reader's parsed objects are shared by every writer
+            for output, recipient in recipients:
+                if clone:
+                    pdf_writer = clone_writer(pdf_reader)
+                else:
+                    pdf_writer = PdfFileWriter()
+                    for page_num in range(pdf_reader.numPages):
+                        pdf_writer.addPage(pdf_reader.getPage(page_num))
+                encrypt_writer(pdf_writer, **recipient)
+                if output is None:
+                    written.append(pypdf3_write(pdf_writer, BytesIO()).getvalue())
+                else:
+                    written.append(pypdf3_write(pdf_writer, output))
+        finally:
+            if pdf_file is not pdf:
+                pdf_file.close()
+    return written
+
+
+def encrypt_recipients(pdf, recipients, output_dir=None, suffix='secured', method='fitz', jobs=1, decrypt=None,
+                       algorithm=None, in_memory=False, clone=False):
+    """
+    Encrypt a PDF document once for each of many recipients, parsing the document only once.
+
+    Recipients are tuples of (user_pw, owner_pw, allow_printing, allow_commenting), trailing
+    values may be omitted, or dictionaries of Encrypt arguments (user_pw, owner_pw, bit128,
+    algorithm, allow_printing, allow_commenting, overwrite_permission and optionally output).
+
+    :param pdf: str or BytesIO
+        PDF document full path or in-memory stream
+    :param recipients: list
+        Password and permission tuples or dictionaries
+    :param output_dir: str
+        Directory to save encrypted documents to (defaults to the document's directory)
+    :param suffix: str
+        Suffix appended to the document's file name, followed by the recipient's number
+    :param method: str
+        PDF library to be used for encryption ('fitz' or 'pypdf3'), AES algorithms use 'fitz'
+    :param jobs: int
+        Number of worker processes, each parses the document once and encrypts a share of recipients
+    :param decrypt: str
+        Owner password to decrypt the source document
+    :param algorithm: str
+        Default encryption algorithm ('rc4-40', 'rc4-128', 'aes-128' or 'aes-256')
+    :param in_memory: bool
+        Return BytesIO streams rather than writing files
+    :param clone: bool
+        Copy the document root wholesale with the 'pypdf3' method (see Encrypt)
+    :return: list
+        Encrypted PDF full paths (BytesIO streams in in_memory mode), in the same order as recipients
+    """
+    recipients = [_recipient(r, algorithm) for r in recipients]
+    if any(is_aes(r['algorithm']) for r in recipients):
+        method = 'fitz'
+
+    # Output paths
+    outputs = []
+    for number, recipient in enumerate(recipients, 1):
+        output = recipient.pop('output', None)
+        if output is None and not in_memory and isinstance(pdf, str):
+            output = add_suffix(pdf, '{0}_{1}'.format(suffix, number))
+            if output_dir:
+                output = os.path.join(output_dir, os.path.basename(output))
+        outputs.append(output)
+    work = list(zip(outputs, recipients))
+
+    # Streams are sent to worker processes as bytes
+    source = pdf.getvalue() if hasattr(pdf, 'getvalue') else pdf
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(work)))
+    if jobs == 1:
+        written = _encrypt_recipients((source, decrypt, method, clone, work))
+    else:
+        size = -(-len(work) // jobs)
+        chunks = [(source, decrypt, method, clone, work[i:i + size]) for i in range(0, len(work), size)]
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            written = [w for chunk in ex.map(_encrypt_recipients, chunks) for w in chunk]
+    return [BytesIO(w) if isinstance(w, bytes) else w for w in written]
+
+
 def main():
     try:
         from pdfconduit import GUI
@@ -1,6 +1,7 @@
-__all__ = ["Watermark", "WatermarkAdd", "Label"]
+__all__ = ["Watermark", "WatermarkAdd", "WatermarkCache", "Label", "watermark_batch"]
 
 
-from pdf.conduit.watermark.watermark import Watermark
+from pdf.conduit.watermark.cache import WatermarkCache
+from pdf.conduit.watermark.watermark import Watermark, watermark_batch
 from pdf.conduit.watermark.add import WatermarkAdd
 from pdf.conduit.watermark.label import Label
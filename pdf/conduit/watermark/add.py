@@ -1,18 +1,24 @@
 # Add a watermark PDF file to another PDF file
-from tempfile import NamedTemporaryFile
+import os
+from io import BytesIO
+from tempfile import NamedTemporaryFile, mkstemp
 from PyBundle import resource_path
-from pdfrw import PdfReader, PdfWriter, PageMerge
-from reportlab.lib.pagesizes import letter
-from PyPDF3 import PdfFileReader, PdfFileWriter
+from pdfrw import PdfWriter, PageMerge, PdfArray
+from PyPDF3 import PdfFileWriter
+from PyPDF3.generic import NameObject, NumberObject
 from PyPDF3.pdf import PageObject
-from pdf.transform.upscale import upscale
-from pdf.transform.rotate import rotate
-from pdf.utils import add_suffix, Info, pypdf3_reader
+from pdf.utils import add_suffix, Info, pypdf3_reader, pdfrw_reader, fitz_reader, pypdf3_write, Stages
+from pdf.utils.matrix import fit, fit_page_matrix, multiply
+from pdf.utils.memory import memory_usage
+from pdf.utils.stream import PdfStreamWriter
+from pdf.utils.timing import file_size
+from pdf.conduit.encrypt import encrypt_writer, encrypt_fitz, is_aes
 
 
 class WatermarkAdd:
     def __init__(self, document, watermark, underneath=False, overwrite=False, output=None, suffix='watermarked',
-                 decrypt=False, tempdir=None, method='pdfrw'):
+                 decrypt=False, tempdir=None, method='pdfrw', in_memory=False, chunk_size=50, max_memory=None,
+                 encrypt=None, stages=None):
         """
         Add a watermark to an existing PDF document
 
@@ -20,32 +26,57 @@ class WatermarkAdd:
         2. Get input PDF document info
             2a. Retrieve dimensions
             2b. Determine orientation
-            2c. Upscale to fit letter
-        3. Get watermark info
-            3a. Retrieve dimensions
-            3b. Rotate if necessary
-            3c. Upscale to fit document
-        4. Set file names
-            4a. Check if a upscaled doc was created, if not use original document
-            4b. Check if watermark was rotated, if not use original watermark
+        3. Get watermark path
+        4. Set output file name (ex: originalpdfname_watermarked.pdf)
         5. Add watermark to PDF document
-            5a. Create watermarked document filename (ex: originalpdfname_watermarked.pdf)
-            5b. Create PDF file reader and file writer objects
-            5c. Add watermark to each page of original
+            5a. Create PDF file reader and file writer objects
+            5b. Compute a transformation matrix (rotate, scale & center) for each distinct page size and
+                rotation, so the watermark fits the page as it's displayed
+            5c. Add transformed watermark to each page of original
             5d. Save watermarked document to file
+
+        The watermark is placed by a transformation matrix applied while merging, neither the
+        document nor the watermark are rotated or upscaled to intermediate files.  When in_memory
+        is True the watermarked document is written to `output` if specified or to a BytesIO
+        stream otherwise.
+
+        The 'stream' method bounds memory use for very large documents, pages are read lazily
+        and written to the output as soon as they are watermarked.  The reader's cache of parsed
+        objects is released every `chunk_size` pages, or after any page once the process's
+        resident memory exceeds `max_memory` megabytes.
+
+        When `encrypt` is a dictionary of Encrypt arguments (user_pw, owner_pw, bit128,
+        allow_printing, allow_commenting, overwrite_permission) the watermarked document is
+        encrypted by the same writer, the document is read and written only once.  pdfrw and
+        the 'stream' method can't encrypt so the 'pypdf3' method is used instead, or the 'fitz'
+        method when an AES algorithm is specified.
+
+        Time spent reading document info, merging and writing is recorded to `stages` (a
+        Stages object) when specified.
         """
-        self.rotate = 0
-        self.scale = 0
         self.underneath = underneath
         self.tempdir = tempdir
         self.method = method
-
-        self.document_reader = pypdf3_reader(document, decrypt)
-        self.document = self._get_document_info(document)
-        self.watermark_file = self._get_watermark_info(self.document, watermark)
-        pdf_fname, wtrmrk_fname = self._set_filenames
-
-        if overwrite:
+        self.in_memory = in_memory
+        self.chunk_size = chunk_size
+        self.max_memory = max_memory
+        self.encrypt = encrypt
+        self.stages = stages if stages is not None else Stages()
+        if encrypt and is_aes(encrypt.get('algorithm')):
+            self.method = method = 'fitz'
+        elif encrypt and method not in ('pypdf3', 'fitz'):
+            self.method = method = 'pypdf3'
+
+        # Read from an open file rather than a path so PyPDF3 parses objects lazily
+        self._document_file = open(document, 'rb') if method == 'stream' and isinstance(document, str) else None
+        with self.stages.time('document info'):
+            self.document_reader = pypdf3_reader(self._document_file or document, decrypt)
+            self.document = self._get_document_info(document)
+            self.watermark_file = {'path': watermark}
+
+        if in_memory and not output:
+            self.output_filename = BytesIO()
+        elif overwrite:
             self.output_filename = document
         elif output:
             self.output_filename = output
@@ -55,11 +86,15 @@ class WatermarkAdd:
             tmpf = NamedTemporaryFile(suffix='.pdf', dir=self.tempdir, delete=False)
             self.output_filename = resource_path(tmpf.name)
 
-        self.add(pdf_fname, wtrmrk_fname)
+        self.add(document, watermark)
 
     def __str__(self):
         return str(self.output_filename)
 
+    @property
+    def file(self):
+        return self.output_filename if hasattr(self.output_filename, 'read') else str(self.output_filename)
+
     def _get_document_info(self, filename):
         pdf_file = {'path': filename}
 
@@ -67,186 +102,221 @@ class WatermarkAdd:
         pdf_file.update(Info(self.document_reader).dimensions)
 
         # 2b. Get PDF file orientation
-        if pdf_file['h'] > pdf_file['w']:
-            pdf_file['orientation'] = 'portrait'
-            letter_size = {'w': int(letter[0]), 'h': int(letter[1])}
-        else:
-            pdf_file['orientation'] = 'landscape'
-            letter_size = {'h': int(letter[0]), 'w': int(letter[1])}
-
-        # 2c. Upscale PDF if it is smaller than a letter
-        if pdf_file['w'] <= letter_size['w'] or pdf_file['h'] <= letter_size['h']:
-            scale = float(letter_size['w'] / pdf_file['w'])
-            pdf_file['upscaled'] = upscale(pdf_file['path'], scale=scale, tempdir=self.tempdir)
-            self.document_reader = pypdf3_reader(pdf_file['upscaled'])
+        pdf_file['orientation'] = 'portrait' if pdf_file['h'] > pdf_file['w'] else 'landscape'
         return pdf_file
 
-    def _get_watermark_info(self, document, watermark, margin_x=0, margin_y=0):
-        # 3a. Get watermark path and dimensions
-        watermark_file = {'path': watermark}
-        watermark_file.update(Info(watermark).dimensions)
-
-        # 3b. Check if watermark file needs to be rotated
-        if watermark_file['w'] > watermark_file['h'] and document['orientation'] == 'portrait':
-            self.rotate = 90
-            watermark_file['rotated'] = rotate(watermark, self.rotate, tempdir=self.tempdir, method=self.method)
-
-        # Set watermark file to be used for upscaling
-        try:
-            wtrmrk = watermark_file['rotated']
-            watermark_file.update(Info(watermark_file['rotated']).dimensions)
-        except KeyError:
-            wtrmrk = watermark_file['path']
-
-        # 3c. Check if watermark file needs to be upscaled
-        scale = 0
-        if watermark_file['w'] <= document['w']:
-            scale = float(document['w'] / watermark_file['w'])
-
-            if watermark_file['h'] * scale > document['h']:
-                scale = float(document['h'] / watermark_file['h'])
-
-            watermark_file['upscaled'] = upscale(wtrmrk, scale=scale, tempdir=self.tempdir, method=self.method)
-        self.scale = scale
-        return watermark_file
-
-    @property
-    def _set_filenames(self):
-        # 4a. If upscaled PDF file does not exists use input PDF path
-        try:
-            pdf = self.document['upscaled']
-        except KeyError:
-            pdf = self.document['path']
-
-        # 4b. If rotated watermark file does not exists use input watermark path
-        try:
-            try:
-                watermark = self.watermark_file['upscaled']
-            except KeyError:
-                watermark = self.watermark_file['rotated']
-        except KeyError:
-            watermark = self.watermark_file['path']
-        return pdf, watermark
-
     def add(self, document, watermark):
         """Add watermark to PDF by merging original PDF and watermark file."""
-        # 5a. Create output PDF file name
         output_filename = self.output_filename
 
         def pypdf3():
             """Much slower than PyPDF3 method."""
-            # 5b. Get our files ready
-            document_reader = PdfFileReader(document)
+            # 5a. Get our files ready
+            document_reader = self.document_reader
             output_file = PdfFileWriter()
 
             # Number of pages in input document
             page_count = document_reader.getNumPages()
 
             # Watermark objects
-            watermark_reader = PdfFileReader(watermark)
+            watermark_reader = pypdf3_reader(watermark)
             wtrmrk_page = watermark_reader.getPage(0)
-            wtrmrk_width = (wtrmrk_page.mediaBox.getWidth() / 2) + 0
-            wtrmrk_height = (wtrmrk_page.mediaBox.getHeight() / 2) + 80
-            wtrmrk_rotate = -int(Info(watermark_reader).rotate) if Info(watermark_reader).rotate is not None else 0
+            wtrmrk_box = tuple(float(x) for x in wtrmrk_page.mediaBox)
+            matrix_cache = {}
 
             # 5c. Go through all the input file pages to add a watermark to them
             for page_number in range(page_count):
+                input_page = document_reader.getPage(page_number)
+
+                # 5b. One transformation matrix per distinct page size and rotation
+                mbox = tuple(float(x) for x in input_page.mediaBox)
+                rotation = int(input_page.get('/Rotate', 0)) % 360
+                ctm = matrix_cache.get((mbox, rotation))
+                if ctm is None:
+                    ctm = matrix_cache[(mbox, rotation)] = fit_page_matrix(wtrmrk_box, mbox, rotation)
+
                 # Merge the watermark with the page
                 if not self.underneath:
-                    input_page = document_reader.getPage(page_number)
-                    if wtrmrk_rotate != 0:
-                        input_page.mergeRotatedTranslatedPage(wtrmrk_page, wtrmrk_rotate, wtrmrk_width, wtrmrk_height)
-                    else:
-                        wtrmrk_width = 0
-                        wtrmrk_height = 0
-                        input_page.mergeTranslatedPage(wtrmrk_page, wtrmrk_width, wtrmrk_height)
+                    input_page.mergeTransformedPage(wtrmrk_page, ctm)
                 else:
-                    size = Info(document_reader).dimensions
-                    input_page = PageObject().createBlankPage(document_reader, size['w'], size['h'])
-                    if wtrmrk_rotate != 0:
-                        input_page.mergeRotatedTranslatedPage(wtrmrk_page, wtrmrk_rotate, wtrmrk_width, wtrmrk_height)
-                    else:
-                        wtrmrk_width = 0
-                        wtrmrk_height = 0
-                        input_page.mergeTranslatedPage(wtrmrk_page, wtrmrk_width, wtrmrk_height)
-                    input_page.mergePage(document_reader.getPage(page_number))
+                    page = PageObject.createBlankPage(document_reader, mbox[2] - mbox[0], mbox[3] - mbox[1])
+                    page.mediaBox = input_page.mediaBox
+                    if rotation:
+                        page[NameObject('/Rotate')] = NumberObject(rotation)
+                    page.mergeTransformedPage(wtrmrk_page, ctm)
+                    page.mergePage(input_page)
+                    input_page = page
 
                 # Add page from input file to output document
                 output_file.addPage(input_page)
+            return output_file
 
-            # 5d. finally, write "output" to PDF
-            with open(output_filename, "wb") as outputStream:
-                output_file.write(outputStream)
-            return output_filename
+        def pypdf3_save(output_file):
+            # 5d. finally, encrypt and write "output" to PDF
+            if self.encrypt:
+                with self.stages.time('encrypt'):
+                    encrypt_writer(output_file, **self.encrypt)
+            return pypdf3_write(output_file, output_filename)
 
         def pdfrw():
             """Faster than PyPDF3 method by as much as 15x."""
-            # TODO: Fix issue where watermark is improperly placed on large pagesize PDFs
-            # print(Info(document).size)
-            # print(Info(watermark).size)
-            # print('\n')
-
             # Open both the source files
-            wmark_trailer = PdfReader(watermark)
-            trailer = PdfReader(document)
+            wmark_trailer = pdfrw_reader(watermark)
+            trailer = pdfrw_reader(document)
 
             # Handle different sized pages in same document with
             # a memoization cache, so we don't create more watermark
             # objects than we need to (typically only one per document).
-
             wmark_page = wmark_trailer.pages[0]
             wmark_cache = {}
 
-            # Process every page
-            for pagenum, page in enumerate(trailer.pages, 1):
-
+            # 5c. Process every page
+            for page in trailer.pages:
                 # Get the media box of the page, and see
                 # if we have a matching watermark in the cache
-                mbox = tuple(float(x) for x in page.MediaBox)
-                odd = pagenum & 1
-                key = mbox, odd
-                wmark = wmark_cache.get(key)
+                mbox = tuple(float(x) for x in page.inheritable.MediaBox)
+                rotation = int(page.inheritable.Rotate or 0) % 360
+                wmark = wmark_cache.get((mbox, rotation))
                 if wmark is None:
+                    # 5b. Create and cache a new watermark object, rotated, scaled
+                    # and centered on the page by its form matrix
+                    wmark = wmark_cache[(mbox, rotation)] = PageMerge().add(wmark_page)[0]
+                    wmark.Matrix = PdfArray(multiply(wmark.Matrix, fit_page_matrix(wmark.box, mbox, rotation)))
 
-                    # Create and cache a new watermark object.
-                    wmark = wmark_cache[key] = PageMerge().add(wmark_page)[0]
-
-                    # The math is more complete than it probably needs to be,
-                    # because the origin of all pages is almost always (0, 0).
-                    # Nonetheless, we illustrate all the values and their names.
-
-                    page_x, page_y, page_x1, page_y1 = mbox
-                    page_w = page_x1 - page_x
-                    page_h = page_y1 - page_y  # For illustration, not used
+                # Add the watermark to the page
+                PageMerge(page).add(wmark, prepend=self.underneath).render()
+            return trailer
 
-                    # Scale the watermark if it is too wide for the page
-                    # (Could do the same for height instead if needed)
-                    if wmark.w > page_w:
-                        wmark.scale(1.0 * page_w / wmark.w)
+        def pdfrw_save(trailer):
+            # 5d. Write out the destination file
+            PdfWriter(output_filename, trailer=trailer).write()
+            if hasattr(output_filename, 'seek'):
+                output_filename.seek(0)
+            return output_filename
 
-                    # Always put watermark at the top of the page
-                    # (but see horizontal positioning for other ideas)
-                    wmark.y += page_y1 - wmark.h
+        def fitz():
+            """Parse, merge and serialize in C using PyMuPDF."""
+            # 5a. Open both the source files
+            doc = fitz_reader(document)
+            wmark = fitz_reader(watermark)
+            wmark_rect = wmark[0].rect
+            rotate_cache = {}
+
+            # 5c. Process every page
+            for page in doc:
+                # 5b. Rotation needed for each distinct page size and rotation, the watermark is fit
+                # to the displayed page and placed in the unrotated page, showPDFpage scales and centers
+                rect = page.rect * page.derotation_matrix
+                key = (tuple(rect), page.rotation)
+                rotation = rotate_cache.get(key)
+                if rotation is None:
+                    rotation = rotate_cache[key] = fit(wmark_rect, page.rect)[0] - page.rotation
+
+                # Add the watermark to the page, the source page's XObject is shared by every page
+                page.showPDFpage(rect, wmark, 0, keep_proportion=True, overlay=not self.underneath,
+                                 rotate=-rotation)
+            return doc, wmark
+
+        def fitz_save(docs):
+            doc, wmark = docs
+
+            # 5d. Encrypt and write out the destination file
+            options = encrypt_fitz(doc, **self.encrypt) if self.encrypt else {}
+            if hasattr(output_filename, 'write'):
+                output_filename.write(doc.write(garbage=1, **options))
+                output_filename.seek(0)
+            elif output_filename == document and not options:
+                doc.saveIncr()
+            elif output_filename == document:
+                # Encryption can't be applied incrementally, overwrite with a full rewrite
+                data = doc.write(garbage=1, **options)
+            else:
+                doc.save(output_filename, garbage=1, **options)
+            doc.close()
+            wmark.close()
+
+            if not hasattr(output_filename, 'write') and output_filename == document and options:
+                with open(output_filename, 'wb') as f:
+                    f.write(data)
+            return output_filename
 
-                    # For odd pages, put it at the left of the page,
-                    # and for even pages, put it on the right of the page.
-                    if odd:
-                        wmark.x = page_x
-                    else:
-                        wmark.x += page_x1 - wmark.w
+        def stream():
+            """Bounded memory, pages are written to the output as soon as they're watermarked."""
+            document_reader = self.document_reader
 
-                    # Optimize the case where the watermark is same width
-                    # as page.
-                    if page_w == wmark.w:
-                        wmark_cache[mbox, not odd] = wmark
+            # Write to a temporary file when overwriting since the document is read while writing
+            overwrite = isinstance(output_filename, str) and output_filename == document
+            if overwrite:
+                fd, destination = mkstemp(suffix='.pdf', dir=os.path.dirname(os.path.abspath(document)))
+                os.close(fd)
+            else:
+                destination = output_filename
 
-                # Add the watermark to the page
-                PageMerge(page).add(wmark, prepend=self.underneath).render()
+            try:
+                with PdfStreamWriter(destination) as writer:
+                    writer.register_pages(document_reader)
+
+                    # The watermark is written once as a Form XObject shared by every page
+                    watermark_reader = pypdf3_reader(watermark)
+                    wtrmrk_page = watermark_reader.getPage(0)
+                    wtrmrk_box = tuple(float(x) for x in wtrmrk_page.mediaBox)
+                    wtrmrk = writer.add_form(wtrmrk_page, watermark_reader)
+                    save = writer.add_stream(b'q')
+                    stamp_cache = {}
+
+                    # 5c. Process every page
+                    for page_number in range(document_reader.getNumPages()):
+                        input_page = document_reader.getPage(page_number)
+
+                        # 5b. One stamp content stream per distinct page size and rotation
+                        mbox = tuple(float(x) for x in input_page.mediaBox)
+                        rotation = int(input_page.get('/Rotate', 0)) % 360
+                        stamp = stamp_cache.get((mbox, rotation))
+                        if stamp is None:
+                            ctm = ' '.join('{0:f}'.format(x) for x in fit_page_matrix(wtrmrk_box, mbox, rotation))
+                            stamp = '{0}q {1} cm /PdfConduitWatermark Do Q'.format(
+                                '' if self.underneath else 'Q ', ctm)
+                            stamp = stamp_cache[(mbox, rotation)] = writer.add_stream(stamp.encode())
+
+                        # Draw the watermark before the page's contents, or after them in a
+                        # restored graphics state
+                        if self.underneath:
+                            writer.add_page(input_page, document_reader, before=[stamp],
+                                            xobjects={'/PdfConduitWatermark': wtrmrk})
+                        else:
+                            writer.add_page(input_page, document_reader, before=[save], after=[stamp],
+                                            xobjects={'/PdfConduitWatermark': wtrmrk})
+
+                        # Release parsed objects that have already been written
+                        if (page_number + 1) % self.chunk_size == 0 or \
+                                (self.max_memory and (memory_usage() or 0) > self.max_memory):
+                            writer.flush(document_reader)
+
+                    # Keep the document information and catalog entries (outlines, forms, names...)
+                    info = document_reader.trailer.get('/Info')
+                    writer.close(info=info.getObject() if info is not None else None,
+                                 catalog=document_reader.trailer['/Root'].getObject(), reader=document_reader)
+            finally:
+                if self._document_file:
+                    self._document_file.close()
+
+            # 5d. Replace the original document
+            if overwrite:
+                os.replace(destination, output_filename)
+            return output_filename
 
-            # Write out the destination file
-            PdfWriter(output_filename, trailer=trailer).write()
+        if self.method == 'stream':
+            # Pages are merged and written in the same pass
+            with self.stages.time('merge', read=document):
+                stream()
+            self.stages.add('write', written=output_filename)
+            return output_filename
 
-        if self.method == 'pypdf3':
-            return pypdf3()
-        else:
-            return pdfrw()
+        merge, save = {'pypdf3': (pypdf3, pypdf3_save), 'fitz': (fitz, fitz_save)}.get(self.method,
+                                                                                       (pdfrw, pdfrw_save))
+        with self.stages.time('merge', read=document):
+            merged = merge()
+        with self.stages.time('write') as stage:
+            save(merged)
+            stage['bytes_written'] += file_size(output_filename)
+        return output_filename
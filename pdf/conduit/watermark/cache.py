@@ -0,0 +1,84 @@
+# Cache rendered watermark PDFs keyed by their drawing parameters
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from pdf.utils.cache import FileCache
+
+
+class WatermarkCache(FileCache):
+    ext = '.pdf'
+
+    def __init__(self, maxsize=64, directory=None, disk_maxsize=1024):
+        """
+        Content-addressed cache of rendered watermark PDFs.
+
+        Watermarks are stored as PDF bytes in an in-process LRU cache and optionally in an
+        on-disk store that can be shared by multiple worker processes.  Keys are a SHA-256
+        hash of the drawing parameters and the contents of the logo image file.
+
+        :param maxsize: int
+            Maximum number of watermarks kept in memory
+        :param directory: str
+            Directory of the on-disk store (disabled when None)
+        :param disk_maxsize: int
+            Maximum number of watermarks kept in the on-disk store
+        """
+        super().__init__(directory, max_files=disk_maxsize)
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize
+        self._memory = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, key):
+        return key in self._memory or (self.directory is not None and os.path.isfile(self._path(key)))
+
+    def key(self, image=None, **params):
+        """
+        Create a cache key from watermark drawing parameters.
+
+        :param image: str
+            Logo image path, the file's contents are hashed rather than its path
+        :param params: Remaining drawing parameters (text, opacity, rotate, pagesize, etc.)
+        :return: str
+            Hex digest
+        """
+        params['image'] = self._file_digest(image) if image and os.path.isfile(image) else image
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        """Retrieve watermark PDF bytes from memory, then from disk, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        data = self._read(key)
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def set(self, key, data):
+        """Store watermark PDF bytes in memory and on disk."""
+        self._remember(key, data)
+        if self.directory and not os.path.isfile(self._path(key)):
+            self._write(key, data)
+        return data
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        """Remove every watermark from memory and from the on-disk store."""
+        with self._lock:
+            self._memory.clear()
+        self._clear_files()
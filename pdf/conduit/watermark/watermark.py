@@ -1,9 +1,13 @@
 # Apply a watermark to a PDF file
 import os
 import shutil
-from tempfile import TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from looptools import Timer
-from pdf.utils import add_suffix, open_window, Receipt, Info
+from pdf.utils import add_suffix, open_window, Receipt, Info, Stages
+from pdf.utils.timing import file_size
 from pdf.modify.draw import WatermarkDraw
 from pdf.modify.canvas import CanvasConstructor
 from pdf.conduit.lib import IMAGE_DEFAULT, IMAGE_DIRECTORY
@@ -11,17 +15,44 @@ from pdf.conduit.encrypt import Encrypt
 from pdf.conduit.watermark.add import WatermarkAdd
 
 
+def _batch_map(func, items, jobs):
+    """Map a function over items in a process pool, or in process when a single job is requested."""
+    if jobs <= 1 or len(items) <= 1:
+        return [func(i) for i in items]
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        return list(ex.map(func, items, chunksize=max(1, len(items) // (jobs * 4))))
+
+
+def _batch_page_size(document):
+    """Retrieve a document's page size, or the error raised while reading it."""
+    try:
+        return Info(document).size, None
+    except Exception as e:
+        return None, '{0}: {1}'.format(type(e).__name__, e)
+
+
+def _batch_add(job):
+    """Add the watermark rendered for a document's page size, returns the output path or an error."""
+    document, watermark, output, underneath, method = job
+    try:
+        watermark = BytesIO(watermark)
+        return str(WatermarkAdd(document, watermark, output=output, underneath=underneath, method=method)), None
+    except Exception as e:
+        return None, '{0}: {1}'.format(type(e).__name__, e)
+
+
 class Watermark:
     def __init__(self, document, remove_temps=True, move_temps=None, open_file=False, tempdir=None, receipt=None,
-                 use_receipt=True, progress_bar_enabled=False, progress_bar='tqdm'):
+                 use_receipt=True, progress_bar_enabled=False, progress_bar='tqdm', in_memory=False, cache=None,
+                 receipt_timings=False):
         """
         Watermark and encrypt a PDF document.
 
         Manage watermarking processes from single class initialization.  This class utilizes the draw,
         add and encrypt modules.
 
-        :param document: str
-            PDF document full path
+        :param document: str, bytes or BytesIO
+            PDF document full path or PDF contents (in_memory mode)
         :param remove_temps: bool
             Remove temporary files after completion
         :param open_file: bool
@@ -32,16 +63,29 @@ class Watermark:
             Use existing Receipt object if already initiated
         :param use_receipt: bool
             Print receipt information to console and write to file
+        :param in_memory: bool
+            Keep the watermark and every intermediate PDF in io.BytesIO streams, only the final
+            document is written to a file (if an output path is specified)
+        :param cache: WatermarkCache
+            Reuse previously rendered watermarks with identical drawing parameters
+        :param receipt_timings: bool
+            Add the time and bytes read/written by each stage to the receipt
         """
         self.time = Timer()
-        self.document_og = document
+        self.stages = Stages()
+        self.receipt_timings = receipt_timings
+        self.in_memory = in_memory
+        self.document_og = BytesIO(document) if isinstance(document, bytes) else document
         self.document = self.document_og
         self.watermark = None
         self.remove_temps = remove_temps
         self.move_temps = move_temps
         self.open_file = open_file
+        self.cache = cache
 
-        if not tempdir:
+        if in_memory and not tempdir:
+            self.tempdir = None
+        elif not tempdir:
             self._temp = TemporaryDirectory()
             self.tempdir = self._temp.name
         elif isinstance(tempdir, TemporaryDirectory):
@@ -58,16 +102,117 @@ class Watermark:
             if isinstance(receipt, Receipt):
                 self.receipt = receipt
             else:
-                self.receipt = Receipt(use_receipt).set_dst(document)
+                self.receipt = Receipt(use_receipt)
+                if isinstance(self.document_og, str):
+                    self.receipt.set_dst(self.document_og)
 
     def __str__(self):
         return str(self.document)
 
+    @classmethod
+    def batch(cls, documents, jobs=None, underneath=False, suffix='watermarked', output_dir=None, method='pdfrw',
+              cache=None, **draw_kwargs):
+        """
+        Watermark many PDF documents in parallel.
+
+        Documents are fanned out to a pool of worker processes.  One watermark is rendered per
+        distinct page size and shared with every worker, errors are reported per document rather
+        than aborting the batch.
+
+        :param documents: list
+            PDF document full paths
+        :param jobs: int
+            Number of worker processes (defaults to the number of CPUs)
+        :param underneath: bool
+            Place watermark either under or over existing PDF documents
+        :param suffix: str
+            Suffix to append to each PDF document file name
+        :param output_dir: str
+            Directory to save watermarked documents to (defaults to each document's directory)
+        :param method: str
+            PDF library to be used for watermark adding
+        :param cache: WatermarkCache
+            Reuse previously rendered watermarks with identical drawing parameters
+        :param draw_kwargs:
+            Watermark drawing parameters (see Watermark.draw)
+        :return: list
+            Dictionaries with 'document', 'output' and 'error' keys, in the same order as documents
+        """
+        documents = list(documents)
+        jobs = jobs or os.cpu_count() or 1
+        draw_kwargs.pop('add', None)
+
+        # Retrieve page sizes, documents that can not be read are reported as errors
+        sizes = _batch_map(_batch_page_size, documents, jobs)
+
+        # Render one watermark per distinct page size
+        watermarks = {}
+        for document, (size, error) in zip(documents, sizes):
+            if error is None and size not in watermarks:
+                wm = cls(document, use_receipt=False, in_memory=True, cache=cache)
+                watermarks[size] = wm.draw(**draw_kwargs).getvalue()
+
+        jobs_list = []
+        for document, (size, error) in zip(documents, sizes):
+            if error is None:
+                output = add_suffix(document, suffix)
+                if output_dir:
+                    output = os.path.join(output_dir, os.path.basename(output))
+                # The watermark's bytes are sent with each job (an executor initializer requires Python 3.7)
+                jobs_list.append((document, watermarks[size], output, underneath, method))
+        added = iter(_batch_map(_batch_add, jobs_list, jobs))
+
+        results = []
+        for document, (size, error) in zip(documents, sizes):
+            output, error = next(added) if error is None else (None, error)
+            results.append({'document': document, 'output': output, 'error': error})
+        return results
+
+    @staticmethod
+    def _name(pdf):
+        """Retrieve a PDF's file name for receipts, in-memory streams do not have one."""
+        return os.path.basename(pdf) if isinstance(pdf, str) else 'in-memory'
+
+    @staticmethod
+    def _to_bytes(pdf):
+        """Retrieve the contents of a PDF file path or in-memory stream."""
+        if hasattr(pdf, 'getvalue'):
+            return pdf.getvalue()
+        with open(pdf, 'rb') as f:
+            return f.read()
+
+    def _from_bytes(self, data):
+        """Create a watermark PDF from cached bytes, a stream in in_memory mode and a temp file otherwise."""
+        if self.in_memory:
+            return BytesIO(data)
+        with NamedTemporaryFile(suffix='.pdf', dir=self.tempdir, delete=False) as tmppdf:
+            tmppdf.write(data)
+            return tmppdf.name
+
+    @property
+    def timings(self):
+        """
+        Retrieve the time and bytes read/written by each stage.
+
+        Stages are canvas, image, draw, watermark write, document info, merge, write and encrypt.
+        Times are in seconds and exclusive of nested stages (image is timed within draw).
+
+        :return: dict
+            Stage names mapped to dicts with 'seconds', 'calls', 'bytes_read' and 'bytes_written' keys
+        """
+        return self.stages.as_dict()
+
     def cleanup(self):
         runtime = self.time.end
         if self.use_receipt:
+            if self.receipt_timings:
+                for stage, record in self.timings.items():
+                    self.receipt.add(stage, '{0:.4f}s (read {1:,} B, written {2:,} B)'.format(
+                        record['seconds'], record['bytes_read'], record['bytes_written']))
             self.receipt.add('~run time~', runtime)
             self.receipt.dump()
+        if not self.tempdir:
+            return self.document
         if self.move_temps:
             if os.path.isdir(self.move_temps):
                 shutil.move(self.tempdir, self.move_temps)
@@ -103,8 +248,8 @@ class Watermark:
             Draw watermark with multiple layers or a single flattened layer
         :param add: bool
             Add watermark to original document
-        :return: str
-            Watermark PDF file full path
+        :return: str or BytesIO
+            Watermark PDF file full path (BytesIO stream in in_memory mode)
         """
         im_path = os.path.join(IMAGE_DIRECTORY, image)
         if os.path.isfile(im_path):
@@ -114,17 +259,36 @@ class Watermark:
         if self.use_receipt:
             self.receipt.add('Text1', text1)
             self.receipt.add('Text2', text2)
-            self.receipt.add('Image', os.path.basename(image))
+            self.receipt.add('Image', self._name(image))
             self.receipt.add('WM Opacity', str(int(opacity * 100)) + '%')
             self.receipt.add('WM Compression', compress)
             self.receipt.add('WM Flattening', flatten)
 
-        co = CanvasConstructor(text1, text2, copyright, image, rotate, opacity, tempdir=self.tempdir)
-        objects, rotate = co.img() if flatten else co.canvas()  # Run img constructor method if flatten is True
+        with self.stages.time('document info'):
+            pagesize = Info(self.document_og).size
+        if self.cache is not None:
+            # Copyright year is drawn to the canvas so it is part of the key
+            key = self.cache.key(image=image, text1=text1, text2=text2, rotate=rotate, opacity=opacity,
+                                 compress=compress, flatten=flatten, pagesize=pagesize,
+                                 copyright=datetime.now().year if copyright else None)
+            cached = self.cache.get(key)
+        else:
+            key, cached = None, None
+
+        if cached is not None:
+            self.watermark = self._from_bytes(cached)
+        else:
+            with self.stages.time('canvas'):
+                co = CanvasConstructor(text1, text2, copyright, image, rotate, opacity, tempdir=self.tempdir,
+                                       in_memory=self.in_memory)
+                objects, rotate = co.img() if flatten else co.canvas()  # Run img constructor if flatten is True
 
-        # Draw watermark to file
-        self.watermark = WatermarkDraw(objects, rotate=rotate, compress=compress, tempdir=self.tempdir,
-                                       pagesize=Info(self.document_og).size, pagescale=True).write()
+            # Draw watermark to file
+            self.watermark = WatermarkDraw(objects, rotate=rotate, compress=compress, tempdir=self.tempdir,
+                                           pagesize=pagesize, pagescale=True, in_memory=self.in_memory,
+                                           stages=self.stages).write()
+            if key:
+                self.cache.set(key, self._to_bytes(self.watermark))
 
         if not add:
             return self.watermark
@@ -132,15 +296,16 @@ class Watermark:
             self.add()
             return self.cleanup()
 
-    def add(self, document=None, watermark=None, underneath=False, output=None, suffix='watermarked', method='pdfrw'):
+    def add(self, document=None, watermark=None, underneath=False, output=None, suffix='watermarked', method='pdfrw',
+            max_memory=None):
         """
         Add a watermark file to an existing PDF document.
 
         Rotate and upscale watermark file as needed to fit existing PDF document.  Watermark can be overlayed or
         placed underneath.
 
-        :param document: str
-            PDF document full path
+        :param document: str, bytes or BytesIO
+            PDF document full path or PDF contents (in_memory mode)
         :param watermark: str
             Watermark PDF full path
         :param underneath: bool
@@ -150,9 +315,11 @@ class Watermark:
         :param suffix: str
             Suffix to append to existing PDF document file name
         :param method: str
-            PDF library to be used for watermark adding
-        :return: str
-            Watermarked PDF Document full path
+            PDF library to be used for watermark adding ('pdfrw', 'pypdf3', 'fitz' or 'stream')
+        :param max_memory: int
+            Memory ceiling in megabytes for the bounded memory 'stream' method
+        :return: str or BytesIO
+            Watermarked PDF Document full path (BytesIO stream in in_memory mode without an output)
         """
         if self.use_receipt:
             self.receipt.add('WM Placement', 'Overlay')
@@ -160,16 +327,19 @@ class Watermark:
             watermark = self.watermark
         if not document:
             document = self.document
-        self.document = str(WatermarkAdd(document, watermark, output=output, underneath=underneath,
-                                         tempdir=self.tempdir, suffix=suffix, method=method))
+        elif isinstance(document, bytes):
+            document = BytesIO(document)
+        self.document = WatermarkAdd(document, watermark, output=output, underneath=underneath,
+                                     tempdir=self.tempdir, suffix=suffix, method=method,
+                                     in_memory=self.in_memory, max_memory=max_memory, stages=self.stages).file
         if self.use_receipt:
-            self.receipt.add('Watermarked PDF', os.path.basename(self.document))
-        if self.open_file:
+            self.receipt.add('Watermarked PDF', self._name(self.document))
+        if self.open_file and isinstance(self.document, str):
             open_window(self.document)
         return self.document
 
     def encrypt(self, user_pw='', owner_pw=None, encrypt_128=True, allow_printing=True, allow_commenting=False,
-                document=None):
+                document=None, output=None, method='pypdf3', algorithm=None):
         """
         Encrypt a PDF document to add passwords and restrict permissions.
 
@@ -186,14 +356,92 @@ class Watermark:
             Encrypt PDF document using 128 bit keys
         :param allow_printing: bool
             Restrict permissions to print only
-        :return: str
-            Encrypted PDF full path
+        :param output: str
+            Output file path
+        :param method: str
+            PDF library to be used for encryption ('pypdf3' or 'fitz')
+        :param algorithm: str
+            Encryption algorithm ('rc4-40', 'rc4-128', 'aes-128' or 'aes-256'), by default RC4 with
+            a key size set by encrypt_128
+        :return: str or BytesIO
+            Encrypted PDF full path (BytesIO stream in in_memory mode without an output)
         """
         document = self.document if document is None else document
+        self._receipt_encrypt(user_pw, owner_pw, encrypt_128, allow_printing, algorithm)
+        if not output and not self.in_memory:
+            output = add_suffix(self.document_og, 'secured')
+        with self.stages.time('encrypt', read=document) as stage:
+            p = Encrypt(document, user_pw, owner_pw, output=output, bit128=encrypt_128,
+                        allow_printing=allow_printing, allow_commenting=allow_commenting,
+                        progress_bar_enabled=self.progress_bar_enabled, progress_bar=self.progress_bar,
+                        in_memory=self.in_memory, method=method, algorithm=algorithm).file
+            stage['bytes_written'] += file_size(p)
+        if self.use_receipt:
+            self.receipt.add('Secured PDF', self._name(p))
+        return p
+
+    def add_and_encrypt(self, user_pw='', owner_pw=None, encrypt_128=True, allow_printing=True,
+                        allow_commenting=False, document=None, watermark=None, underneath=False, output=None,
+                        method='pypdf3', algorithm=None):
+        """
+        Add a watermark file to an existing PDF document and encrypt it in a single write.
+
+        Equivalent to calling add() then encrypt(), but the document is parsed and serialized once
+        rather than twice and no intermediate watermarked document is written.
+
+        :param user_pw: str
+            User password required to open and view PDF document
+        :param owner_pw: str
+            Owner password required to alter security settings and permissions
+        :param encrypt_128: bool
+            Encrypt PDF document using 128 bit keys
+        :param allow_printing: bool
+            Restrict permissions to print only
+        :param allow_commenting: bool
+            Allow users to add comments
+        :param document: str, bytes or BytesIO
+            PDF document full path or PDF contents (in_memory mode)
+        :param watermark: str
+            Watermark PDF full path
+        :param underneath: bool
+            Place watermark either under or over existing PDF document
+        :param output: str
+            Output file path
+        :param method: str
+            PDF library to be used ('pypdf3' or 'fitz')
+        :param algorithm: str
+            Encryption algorithm ('rc4-40', 'rc4-128', 'aes-128' or 'aes-256'), AES uses the 'fitz' method
+        :return: str or BytesIO
+            Watermarked and encrypted PDF full path (BytesIO stream in in_memory mode without an output)
+        """
+        watermark = self.watermark if not watermark else watermark
+        document = self.document if not document else document
+        if isinstance(document, bytes):
+            document = BytesIO(document)
+        if self.use_receipt:
+            self.receipt.add('WM Placement', 'Underneath' if underneath else 'Overlay')
+        self._receipt_encrypt(user_pw, owner_pw, encrypt_128, allow_printing, algorithm)
+        if not output and not self.in_memory:
+            output = add_suffix(self.document_og, 'secured')
+
+        encrypt = {'user_pw': user_pw, 'owner_pw': owner_pw, 'bit128': encrypt_128,
+                   'allow_printing': allow_printing, 'allow_commenting': allow_commenting, 'algorithm': algorithm}
+        self.document = WatermarkAdd(document, watermark, output=output, underneath=underneath,
+                                     tempdir=self.tempdir, method=method, in_memory=self.in_memory,
+                                     encrypt=encrypt, stages=self.stages).file
+        if self.use_receipt:
+            self.receipt.add('Secured PDF', self._name(self.document))
+        if self.open_file and isinstance(self.document, str):
+            open_window(self.document)
+        return self.document
+
+    def _receipt_encrypt(self, user_pw, owner_pw, encrypt_128, allow_printing, algorithm=None):
         if self.use_receipt:
             self.receipt.add('User pw', user_pw)
             self.receipt.add('Owner pw', owner_pw)
-            if encrypt_128:
+            if algorithm:
+                self.receipt.add('Encryption', algorithm.upper())
+            elif encrypt_128:
                 self.receipt.add('Encryption key size', '128')
             else:
                 self.receipt.add('Encryption key size', '40')
@@ -201,9 +449,9 @@ class Watermark:
                 self.receipt.add('Permissions', 'Allow printing')
             else:
                 self.receipt.add('Permissions', 'Allow ALL')
-        p = str(Encrypt(document, user_pw, owner_pw, output=add_suffix(self.document_og, 'secured'),
-                        bit128=encrypt_128, allow_printing=allow_printing, allow_commenting=allow_commenting,
-                        progress_bar_enabled=self.progress_bar_enabled, progress_bar=self.progress_bar))
-        if self.use_receipt:
-            self.receipt.add('Secured PDF', os.path.basename(p))
-        return p
+
+
+def watermark_batch(documents, jobs=None, underneath=False, suffix='watermarked', output_dir=None, method='pdfrw',
+                    cache=None, **draw_kwargs):
+    """Watermark many PDF documents in parallel over a process pool."""
+    return Watermark.batch(documents, jobs, underneath, suffix, output_dir, method, cache, **draw_kwargs)
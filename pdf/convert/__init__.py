@@ -1,6 +1,7 @@
+from pdf.convert.cache import RenderCache
 from pdf.convert.flatten import Flatten
 from pdf.convert.img2pdf import img2pdf, IMG2PDF
 from pdf.convert.pdf2img import pdf2img, PDF2IMG
 
 # TODO: Create conversion modules pdf2docx, docx2pdf, html2pdf, csv2pdf, excel2pdf
-__all__ = ['img2pdf', 'pdf2img', 'IMG2PDF', 'PDF2IMG', 'Flatten']
+__all__ = ['img2pdf', 'pdf2img', 'IMG2PDF', 'PDF2IMG', 'Flatten', 'RenderCache']
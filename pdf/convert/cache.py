@@ -0,0 +1,76 @@
+# Cache rendered page images on disk keyed by document contents and render settings
+import hashlib
+import json
+import os
+
+from pdf.utils.cache import FileCache
+
+
+class RenderCache(FileCache):
+    ext = '.img'
+
+    def __init__(self, directory, maxsize=512 * 1024 * 1024):
+        """
+        Content-addressed on-disk cache of rendered page images.
+
+        Keys are a SHA-256 hash of the document's contents, the page number and the render settings
+        (dpi, alpha, image format and encoder options), so a renamed or copied document still hits
+        and an edited document misses.  When the cache grows larger than maxsize, the least recently
+        used images are removed.  The store can be shared by multiple worker processes.
+
+        :param directory: str
+            Directory of the on-disk store
+        :param maxsize: int
+            Maximum total size of cached images in bytes
+        """
+        super().__init__(directory, max_bytes=maxsize)
+        self.maxsize = maxsize
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def key(self, file_name, page, dpi=None, alpha=False, ext='.png', **options):
+        """
+        Create a cache key for a rendered page.
+
+        :param file_name: str
+            PDF document path, the file's contents are hashed rather than its path
+        :param page: int
+            Page number (starting at 0)
+        :param dpi: Rendering resolution
+        :param alpha: bool
+            Rendered with an alpha channel
+        :param ext: str
+            Image format extension
+        :param options: Remaining encoder options (quality, compression)
+        :return: str
+            Hex digest
+        """
+        params = dict(options, document=self._file_digest(file_name), page=page, dpi=dpi, alpha=bool(alpha),
+                      ext=ext.lower())
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        """Retrieve cached image bytes, or None on a miss."""
+        return self._read(key)
+
+    def copy(self, key, output):
+        """Copy a cached image to an output path, return the output or None on a miss."""
+        return self._copy(key, output)
+
+    def set(self, key, data):
+        """Store image bytes."""
+        self._write(key, data)
+        return data
+
+    def set_file(self, key, path):
+        """Store a copy of an image file."""
+        self._write(key, source=path)
+        return path
+
+    def clear(self):
+        """Remove every image from the on-disk store."""
+        self._clear_files()
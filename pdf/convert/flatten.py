@@ -9,8 +9,11 @@ from pdf.utils.path import add_suffix
 
 
 class Flatten:
-    def __init__(self, file_name, scale=1.0, suffix='flat', tempdir=None, progress_bar=None):
-        """Create a flat single-layer PDF by converting each page to a PNG image"""
+    def __init__(self, file_name, scale=1.0, suffix='flat', tempdir=None, progress_bar=None, jobs=1, cache=None):
+        """Create a flat single-layer PDF by converting each page to a PNG image (in jobs worker processes)
+
+        Page images are reused from a RenderCache when one is given.
+        """
         self._file_name = file_name
 
         if not tempdir:
@@ -25,6 +28,8 @@ class Flatten:
         self.suffix = suffix
         self.directory = os.path.dirname(file_name)
         self.progress_bar = progress_bar
+        self.jobs = jobs
+        self.cache = cache
 
         if scale and scale != 0 and scale != 1.0:
             self.file_name = upscale(file_name, scale=scale, tempdir=self.tempdir)
@@ -38,7 +43,8 @@ class Flatten:
         return str(self.pdf)
 
     def get_imgs(self):
-        self.imgs = PDF2IMG(self.file_name, tempdir=self.tempdir, progress_bar=self.progress_bar).save()
+        self.imgs = PDF2IMG(self.file_name, tempdir=self.tempdir, progress_bar=self.progress_bar,
+                            jobs=self.jobs, cache=self.cache).save()
         return self.imgs
 
     def save(self, remove_temps=True):
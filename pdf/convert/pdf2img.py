@@ -1,5 +1,8 @@
 # Convert each page of PDF to images
+import math
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from sys import modules
 from tempfile import NamedTemporaryFile
@@ -11,15 +14,121 @@ from tqdm import tqdm
 from pdf.utils.path import add_suffix
 
 
+# Image formats written by PIL from a pixmap's samples, PNG images are written by MuPDF
+PIL_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP', '.tif': 'TIFF', '.tiff': 'TIFF'}
+
+# Tile pyramid layouts and the DeepZoom image descriptor
+PYRAMID_LAYOUTS = ('deepzoom', 'xyz')
+DZI = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{fmt}" Overlap="{overlap}" TileSize="{tile_size}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def _save_image(image, output, quality=None, compression=None):
+    """Save a PIL image in the format of the output's extension."""
+    image_format = PIL_FORMATS.get(os.path.splitext(output)[1].lower())
+    if image.mode == 'RGBA' and image_format == 'JPEG':
+        image = image.convert('RGB')
+    options = {}
+    if quality is not None:
+        options['quality'] = quality
+    if compression is not None:
+        options['compression'] = compression
+    image.save(output, format=image_format, **options)
+    return output
+
+
+def write_pixmap(pix, output, quality=None, compression=None):
+    """
+    Write a fitz Pixmap to an image file without a PNG encode and decode round trip.
+
+    PNG images are written directly by MuPDF.  Other formats are encoded once by PIL from the
+    pixmap's raw samples.
+
+    :param pix: fitz Pixmap
+    :param output: Image file path, the format is determined by its extension
+    :param quality: JPEG and WebP quality (1-100)
+    :param compression: TIFF compression (ex: 'tiff_lzw', 'tiff_deflate' or 'jpeg')
+    :return: Output path
+    """
+    if output.lower().endswith('.png'):
+        pix.writePNG(output)
+        return output
+    image = Image.frombytes('RGBA' if pix.alpha else 'RGB', (pix.width, pix.height), pix.samples)
+    return _save_image(image, output, quality, compression)
+
+
+def _grid(rect, width, height, tile_size, overlap=0):
+    """
+    Split a page rectangle rendered at width x height pixels into pixel-aligned tiles.
+
+    Tiles share overlap pixels with their neighbours, those in the last row and column may be smaller.
+
+    :return: Generator of (row, column, clip) tuples, clip is a page rectangle
+    """
+    sx, sy = width / rect.width, height / rect.height
+    for row, y in enumerate(range(0, height, tile_size)):
+        y0, y1 = max(y - overlap, 0), min(y + tile_size + overlap, height)
+        for col, x in enumerate(range(0, width, tile_size)):
+            x0, x1 = max(x - overlap, 0), min(x + tile_size + overlap, width)
+            yield row, col, fitz.Rect(rect.x0 + x0 / sx, rect.y0 + y0 / sy, rect.x0 + x1 / sx, rect.y0 + y1 / sy)
+
+
+def _render_tiles(job):
+    """Render and save tiles of a page in a worker process from its own fitz document."""
+    file_name, pno, tile_size, alpha, tiles, options = job
+    pdf2img = PDF2IMG(file_name, alpha=alpha, **options)
+    try:
+        grid = {(row, col): clip for row, col, clip in pdf2img.tiles(pno, tile_size)}
+        return [write_pixmap(pdf2img._get_tile(pno, grid[(row, col)]), output, pdf2img.quality,
+                             pdf2img.compression) for row, col, output in tiles]
+    finally:
+        pdf2img.doc.close()
+
+
+def _render_pages(job):
+    """Render a range of pages in a worker process from its own fitz document."""
+    file_name, pages, alpha, outputs, options, keys = job
+    pdf2img = PDF2IMG(file_name, alpha=alpha, **options)
+    try:
+        return list(pdf2img._render(pages, keep_dlists=False, outputs=outputs, keys=keys))
+    finally:
+        pdf2img.doc.close()
+
+
 class PDF2IMG:
-    def __init__(self, file_name, output=None, tempdir=None, ext='.png', progress_bar=None, alpha=False):
-        """Convert each page of a PDF file into a PNG image"""
+    def __init__(self, file_name, output=None, tempdir=None, ext='.png', progress_bar=None, alpha=False, jobs=1,
+                 quality=None, compression=None, dpi=None, cache=None):
+        """
+        Convert each page of a PDF file into a PNG image
+
+        When jobs is greater than 1, the pages are split into ranges rendered by that many worker
+        processes (each opening its own fitz document) and reassembled in page order.
+
+        Images are saved as PNG, JPEG, WebP or TIFF images depending on ext, with quality used by
+        JPEG and WebP images and compression by TIFF images.
+
+        Pages are rendered at dpi (72, the page's native resolution, by default).  Oversized pages
+        can be rendered as fixed-size tiles with iter_tiles() or save_tiles() so no pixmap is
+        larger than a tile.
+
+        When a RenderCache is given, page images rendered with the same document contents and
+        settings are reused instead of creating the page's display list and rendering it.
+        """
         self.file_name = file_name
         self.output = output
         self.tempdir = tempdir
-        self.ext = ext
+        self.ext = '.' + ext.lstrip('.')
         self.progress_bar = progress_bar
         self.alpha = alpha
+        self.jobs = jobs
+        self.quality = quality
+        self.compression = compression
+        self.dpi = dpi
+        self.zoom = dpi / 72 if dpi else 1
+        self.cache = cache
 
         self.doc = fitz.open(self.file_name)
         self.output_dir = os.path.dirname(file_name) if tempdir is None else tempdir
@@ -34,13 +143,77 @@ class PDF2IMG:
             self._page_data = self._get_pdf_data()
         return self._page_data
 
+    def _render(self, pages, keep_dlists=True, outputs=None, keys=None):
+        """
+        Yield the PNG image of each page in order, rendering in worker processes when jobs > 1.
+
+        When outputs are given, each page is written to its output and the output is yielded
+        instead.  When keep_dlists is False, display lists created for a page are released once
+        it's rendered.  Render cache keys are computed for each page unless keys are given.
+        """
+        jobs = min(self.jobs or os.cpu_count() or 1, len(pages))
+        if jobs <= 1:
+            for i, pno in enumerate(pages):
+                output = outputs[i] if outputs else None
+                key = keys[i] if keys else self._cache_key(pno, output)
+                if key is not None:
+                    hit = self.cache.copy(key, output) if output else self.cache.get(key)
+                    if hit is not None:
+                        yield hit
+                        continue
+
+                cached = self.dlist_tab[pno] is not None
+                pix = self._get_pixmap(pno)
+                if not keep_dlists and not cached:
+                    self.dlist_tab[pno] = None
+                if output:
+                    write_pixmap(pix, output, self.quality, self.compression)
+                    if key is not None:
+                        self.cache.set_file(key, output)
+                    yield output
+                else:
+                    data = pix.getPNGData()
+                    if key is not None:
+                        self.cache.set(key, data)
+                    yield data
+            return
+
+        # Several contiguous ranges per worker to balance pages that are slower to render, a bounded
+        # number of rendered ranges are pending
+        size = -(-len(pages) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            pending = deque()
+            options = {'quality': self.quality, 'compression': self.compression, 'dpi': self.dpi,
+                       'cache': self.cache}
+            for i in range(0, len(pages), size):
+                # Cache keys are computed here so the document is only hashed once
+                chunk_outputs = outputs[i:i + size] if outputs else None
+                keys = [self._cache_key(pno, chunk_outputs[j] if chunk_outputs else None)
+                        for j, pno in enumerate(pages[i:i + size])] if self.cache is not None else None
+                job = (self.file_name, pages[i:i + size], self.alpha, chunk_outputs, options, keys)
+                pending.append(ex.submit(_render_pages, job))
+                if len(pending) >= jobs * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _cache_key(self, pno, output=None):
+        """Retrieve the render cache key of a page's image saved to output (PNG data by default)."""
+        if self.cache is None:
+            return None
+        ext = os.path.splitext(output)[1] if output else '.png'
+        options = {} if ext.lower() == '.png' else {'quality': self.quality, 'compression': self.compression}
+        return self.cache.key(self.file_name, pno, self.dpi, self.alpha, ext, **options)
+
     def _get_pdf_data(self):
+        pages = range(len(self.doc))
+
         # PySimpleGUI progress bar
         if self.progress_bar == 'gui' and 'PySimpleGUI' in modules:
             import PySimpleGUI as gui
             data = []
-            for i, cur_page in enumerate(range(len(self.doc))):
-                data.append(self._get_page_data(cur_page))
+            for i, page_data in enumerate(self._render(pages)):
+                data.append(page_data)
                 if not gui.OneLineProgressMeter('Getting PDF page data', i + 1, len(self.doc), orientation='h',
                                                 key='progress'):
                     break
@@ -48,29 +221,43 @@ class PDF2IMG:
 
         # TQDM progress bar
         elif self.progress_bar == 'tqdm':
-            return [self._get_page_data(cur_page) for cur_page in tqdm(range(len(self.doc)),
-                                                                       desc='Getting PDF page data',
-                                                                       total=len(self.doc), unit='Pages')]
+            return list(tqdm(self._render(pages), desc='Getting PDF page data', total=len(self.doc), unit='Pages'))
         # No progress bar
         else:
-            return [self._get_page_data(cur_page) for cur_page in range(len(self.doc))]
+            return list(self._render(pages))
+
+    def iter_pages(self):
+        """Render and encode one page at a time, yielding the PNG image of each page in order."""
+        if self._page_data:
+            yield from self._page_data
+            return
+
+        yield from self._render(range(len(self.doc)), keep_dlists=False)
 
     def _get_page_data(self, pno, zoom=0):
         """
         Return a PNG image for a document page number. If zoom is other than 0, one of
         the 4 page quadrants are zoomed-in instead and the corresponding clip returned.
         """
+        return self._get_pixmap(pno, zoom).getPNGData()  # return the PNG image
+
+    def _get_dlist(self, pno):
         dlist = self.dlist_tab[pno]  # get display list
         if not dlist:  # create if not yet there
             self.dlist_tab[pno] = self.doc[pno].getDisplayList()
             dlist = self.dlist_tab[pno]
+        return dlist
+
+    def _get_pixmap(self, pno, zoom=0):
+        """Return a Pixmap for a document page number, or one of its quadrants (see _get_page_data)."""
+        dlist = self._get_dlist(pno)
         r = dlist.rect  # page rectangle
         mp = r.tl + (r.br - r.tl) * 0.5  # rect middle point
         mt = r.tl + (r.tr - r.tl) * 0.5  # middle of top edge
         ml = r.tl + (r.bl - r.tl) * 0.5  # middle of left edge
         mr = r.tr + (r.br - r.tr) * 0.5  # middle of right egde
         mb = r.bl + (r.br - r.bl) * 0.5  # middle of bottom edge
-        mat = fitz.Matrix(2, 2)  # zoom matrix
+        mat = fitz.Matrix(2 * self.zoom, 2 * self.zoom)  # zoom matrix
         if zoom == 1:  # top-left quadrant
             clip = fitz.Rect(r.tl, mp)
         elif zoom == 4:  # bot-right quadrant
@@ -80,10 +267,153 @@ class PDF2IMG:
         elif zoom == 3:  # bot-left
             clip = fitz.Rect(ml, mb)
         if zoom == 0:  # total page
-            pix = dlist.getPixmap(alpha=self.alpha)
+            pix = dlist.getPixmap(alpha=self.alpha, matrix=fitz.Matrix(self.zoom, self.zoom))
         else:
             pix = dlist.getPixmap(alpha=self.alpha, matrix=mat, clip=clip)
-        return pix.getPNGData()  # return the PNG image
+        return pix
+
+    def tiles(self, pno, tile_size=1024, zoom=None):
+        """
+        Retrieve the tiles a page is split into when it's rendered.
+
+        :param pno: Page number (starting at 0)
+        :param tile_size: Width and height of tiles in pixels, tiles in the last row and column may be smaller
+        :param zoom: Rendering scale (dpi / 72 by default)
+        :return: List of (row, column, clip) tuples, clip is a page rectangle
+        """
+        zoom = self.zoom if zoom is None else zoom
+        r = self._get_dlist(pno).rect
+        return list(_grid(r, round(r.width * zoom), round(r.height * zoom), tile_size))
+
+    def _get_tile(self, pno, clip, matrix=None):
+        """Render a clip of a page from its display list."""
+        matrix = fitz.Matrix(self.zoom, self.zoom) if matrix is None else matrix
+        return self._get_dlist(pno).getPixmap(alpha=self.alpha, matrix=matrix, clip=clip)
+
+    def iter_tiles(self, pno, tile_size=1024):
+        """
+        Render a page one tile at a time, the page's display list is only created once.
+
+        :param pno: Page number (starting at 0)
+        :param tile_size: Width and height of tiles in pixels
+        :return: Generator of (row, column, Pixmap) tuples
+        """
+        for row, col, clip in self.tiles(pno, tile_size):
+            yield row, col, self._get_tile(pno, clip)
+
+    def pyramid_levels(self, pno, tile_size=256, layout='deepzoom'):
+        """
+        Retrieve the levels of a page's tile pyramid, from the smallest to the full resolution.
+
+        Every level is half the size of the next (rounded up).  DeepZoom pyramids start at a 1x1
+        pixel level, XYZ pyramids start at the level that fits in a single tile.
+
+        :param pno: Page number (starting at 0)
+        :param tile_size: Width and height of tiles in pixels
+        :param layout: 'deepzoom' or 'xyz'
+        :return: List of (level, width, height) tuples
+        """
+        if layout not in PYRAMID_LAYOUTS:
+            raise ValueError("layout must be one of {0}".format(', '.join(PYRAMID_LAYOUTS)))
+        r = self._get_dlist(pno).rect
+        width, height = round(r.width * self.zoom), round(r.height * self.zoom)
+        top = math.ceil(math.log2(max(width, height, 1)))
+        first = 0 if layout == 'deepzoom' else top - max(math.ceil(math.log2(max(width, height) / tile_size)), 0)
+        return [(level - first, -(-width // 2 ** (top - level)), -(-height // 2 ** (top - level)))
+                for level in range(first, top + 1)]
+
+    def pyramid(self, pno, tile_size=256, overlap=0, layout='deepzoom'):
+        """
+        Render a page's tile pyramid one tile at a time.
+
+        Every level and tile is clipped from the page's display list, which is only created once,
+        rather than re-rendering the page for each level.
+
+        :param pno: Page number (starting at 0)
+        :param tile_size: Width and height of tiles in pixels (without overlap)
+        :param overlap: Pixels shared by neighbouring tiles (DeepZoom)
+        :param layout: 'deepzoom' or 'xyz'
+        :return: Generator of (level, row, column, Pixmap) tuples
+        """
+        r = self._get_dlist(pno).rect
+        for level, width, height in self.pyramid_levels(pno, tile_size, layout):
+            matrix = fitz.Matrix(width / r.width, height / r.height)
+            for row, col, clip in _grid(r, width, height, tile_size, overlap):
+                yield level, row, col, self._get_tile(pno, clip, matrix)
+
+    def save_pyramid(self, pno=0, tile_size=256, overlap=0, layout='deepzoom'):
+        """
+        Save a page's tile pyramid for web viewers in output_dir.
+
+        DeepZoom pyramids are saved as <file>_<page>.dzi with tiles in <file>_<page>_files/<level>/<column>_<row>,
+        XYZ pyramids are saved as <file>_<page>/<level>/<column>/<row> tiles.
+
+        :param pno: Page number (starting at 0)
+        :param tile_size: Width and height of tiles in pixels (without overlap)
+        :param overlap: Pixels shared by neighbouring tiles (DeepZoom)
+        :param layout: 'deepzoom' or 'xyz'
+        :return: Path of the DeepZoom descriptor or XYZ tile directory
+        """
+        name = os.path.splitext(os.path.basename(add_suffix(self.file_name, str(pno + 1))))[0]
+        name = os.path.join(self.output_dir, name)
+        directory = name + '_files' if layout == 'deepzoom' else name
+        for level, row, col, pix in self.pyramid(pno, tile_size, overlap, layout):
+            if layout == 'deepzoom':
+                output = os.path.join(directory, str(level), '{0}_{1}{2}'.format(col, row, self.ext))
+            else:
+                output = os.path.join(directory, str(level), str(col), '{0}{1}'.format(row, self.ext))
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            write_pixmap(pix, output, self.quality, self.compression)
+
+        if layout != 'deepzoom':
+            return directory
+        level, width, height = self.pyramid_levels(pno, tile_size, layout)[-1]
+        with open(name + '.dzi', 'w') as f:
+            f.write(DZI.format(fmt=self.ext.lstrip('.'), overlap=overlap, tile_size=tile_size, width=width,
+                               height=height))
+        return name + '.dzi'
+
+    def _get_tile_output(self, pno, row, col):
+        output_file = add_suffix(self.file_name, '{0}_{1}_{2}'.format(pno + 1, row, col), ext=self.ext)
+        return os.path.join(self.output_dir, os.path.basename(output_file))
+
+    def save_tiles(self, pages=None, tile_size=1024):
+        """
+        Save pages as fixed-size tile images (named <file>_<page>_<row>_<column>).
+
+        When jobs is greater than 1, the tiles of every page are rendered by one pool of worker
+        processes.
+
+        :param pages: Page numbers (starting at 0) to save, all pages by default
+        :param tile_size: Width and height of tiles in pixels
+        :return: List of tile image paths, in page, row and column order
+        """
+        pages = range(len(self.doc)) if pages is None else pages
+        jobs = self.jobs or os.cpu_count() or 1
+        if jobs <= 1:
+            return [write_pixmap(pix, self._get_tile_output(pno, row, col), self.quality, self.compression)
+                    for pno in pages for row, col, pix in self.iter_tiles(pno, tile_size)]
+
+        # One pool renders every page's tiles, a bounded number of tile chunks are pending
+        saved = []
+        options = {'quality': self.quality, 'compression': self.compression, 'dpi': self.dpi}
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            pending = deque()
+            for pno in pages:
+                cached = self.dlist_tab[pno] is not None
+                tiles = [(row, col, self._get_tile_output(pno, row, col))
+                         for row, col, clip in self.tiles(pno, tile_size)]
+                if not cached:
+                    self.dlist_tab[pno] = None
+                size = -(-len(tiles) // jobs)
+                for i in range(0, len(tiles), size):
+                    pending.append(ex.submit(_render_tiles, (self.file_name, pno, tile_size, self.alpha,
+                                                             tiles[i:i + size], options)))
+                    if len(pending) >= jobs * 2:
+                        saved.extend(pending.popleft().result())
+            while pending:
+                saved.extend(pending.popleft().result())
+        return saved
 
     def _get_output(self, index):
         if self.output:
@@ -95,39 +425,50 @@ class PDF2IMG:
             with NamedTemporaryFile(suffix=self.ext, dir=self.tempdir, delete=True) as temp:
                 return temp.name
 
+    def _save_pages(self):
+        """Yield each page's output as soon as its image is saved."""
+        outputs = [self._get_output(i) for i in range(len(self.doc))]
+        if not self._page_data:
+            yield from self._render(range(len(self.doc)), keep_dlists=False, outputs=outputs)
+            return
+
+        # Pages that were already rendered are only decoded to be saved in other formats
+        for output, img in zip(outputs, self._page_data):
+            if output.lower().endswith('.png'):
+                with open(output, 'wb') as f:
+                    f.write(img)
+            else:
+                with Image.open(BytesIO(img)) as image:
+                    _save_image(image, output, self.quality, self.compression)
+            yield output
+
     def save(self):
+        """Save each page's image as soon as it's rendered and return the image paths."""
+        pages = self._save_pages()
+
         # PySimpleGUI progress bar
         if self.progress_bar == 'gui' and 'PySimpleGUI' in modules:
             import PySimpleGUI as gui
             saved = []
-            for i, img in enumerate(self.pdf_data):
-                output = self._get_output(i)
+            for i, output in enumerate(pages):
                 saved.append(output)
-                with Image.open(BytesIO(img)) as image:
-                    image.save(output)
-                if not gui.OneLineProgressMeter('Saving PDF pages as PNGs', i + 1, len(self.doc), orientation='h',
-                                                key='progress'):
+                if not gui.OneLineProgressMeter('Saving PDF pages as images', i + 1, len(self.doc),
+                                                orientation='h', key='progress'):
                     break
             self.doc.close()
             return saved
         # TQDM progress bar
         elif self.progress_bar == 'tqdm':
-            loop = enumerate(tqdm(self.pdf_data, desc='Saving PDF pages as PNGs', total=len(self.pdf_data),
-                                  unit='PNGs'))
+            saved = list(tqdm(pages, desc='Saving PDF pages as images', total=len(self.doc), unit='Images'))
         # No progress bar
         else:
-            loop = enumerate(self.pdf_data)
-        saved = []
-        for i, img in loop:
-            output = self._get_output(i)
-            saved.append(output)
-            with Image.open(BytesIO(img)) as image:
-                image.save(output)
+            saved = list(pages)
         self.doc.close()
         return saved
 
 
-def pdf2img(file_name, output=None, tempdir=None, ext='png', progress_bar=None, alpha=False):
+def pdf2img(file_name, output=None, tempdir=None, ext='png', progress_bar=None, alpha=False, jobs=1, quality=None,
+            compression=None, dpi=None, cache=None):
     """Wrapper function for PDF2IMG class"""
     return PDF2IMG(file_name=file_name, output=output, tempdir=tempdir, ext=ext, progress_bar=progress_bar,
-                   alpha=alpha).save()
+                   alpha=alpha, jobs=jobs, quality=quality, compression=compression, dpi=dpi, cache=cache).save()
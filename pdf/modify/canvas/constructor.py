@@ -1,12 +1,14 @@
 from datetime import datetime
 
+from PIL import Image, ImageEnhance
 from PillowImage import PillowImage
 
 from pdf.modify.canvas.objects import CanvasObjects, CanvasStr, CanvasImg
 
 
 class CanvasConstructor:
-    def __init__(self, text1=None, text2=None, copyright_=None, image=None, rotate=0, opacity=8, tempdir=None):
+    def __init__(self, text1=None, text2=None, copyright_=None, image=None, rotate=0, opacity=8, tempdir=None,
+                 in_memory=False):
         self.text1 = text1
         self.text2 = text2
         self.copyright = copyright_
@@ -14,6 +16,7 @@ class CanvasConstructor:
         self.rotate = rotate
         self.opacity = opacity
         self.tempdir = tempdir
+        self.in_memory = in_memory
 
         # Initialize CanvasObjects collector class and add objects
         self.obj = CanvasObjects()
@@ -53,10 +56,25 @@ class CanvasConstructor:
                 self.obj.add(CanvasStr('© copyright ' + str(datetime.now().year), opacity=self.opacity, size=16, y=50))
         return self.objects
 
+    def _draw_img(self, img):
+        """Paste the image scaled to fit the canvas with its opacity reduced in memory (see PillowImage.draw_img)."""
+        with Image.open(self.image) as im:
+            im = im.convert('RGBA') if im.mode != 'RGBA' else im.copy()
+        if 0 <= self.opacity <= 1:
+            im.putalpha(ImageEnhance.Brightness(im.split()[3]).enhance(self.opacity))
+        scale = min(img.width / im.size[0], img.height / im.size[1])
+        im.thumbnail((int(im.size[0] * scale), int(im.size[1] * scale)))
+        img.img.alpha_composite(im, img.image_bound(im, 0, 50))
+
     def img(self):
-        with PillowImage() as img:
+        # PillowImage only creates a temporary directory when an image is saved to a file
+        img = PillowImage()
+        try:
             if self.image is not None:
-                img.draw_img(self.image, x=0, y=50, opacity=self.opacity)
+                if self.in_memory:
+                    self._draw_img(img)
+                else:
+                    img.draw_img(self.image, x=0, y=50, opacity=self.opacity)
 
                 if self.text1 and self.text2 and self.copyright:
                     img.draw_text(self.text1, font_size=40, y=416, opacity=self.opacity)
@@ -84,6 +102,9 @@ class CanvasConstructor:
 
             img.rotate(self.rotate)
             self.rotate = 0
-            i = img.save(destination=self.tempdir)
+            i = img.img.copy() if self.in_memory else img.save(destination=self.tempdir)
             self.obj.add(CanvasImg(i, opacity=1, centered=True))
             return self.objects
+        finally:
+            if not self.in_memory:
+                img.cleanup()
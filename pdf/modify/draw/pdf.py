@@ -2,14 +2,17 @@
 import io
 from tempfile import NamedTemporaryFile, mkdtemp
 
+from PIL import Image, ImageEnhance
 from PillowImage import img_adjust
 from PyBundle import resource_path
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen.canvas import Canvas
 
 from pdf.modify import LETTER
 from pdf.modify.canvas import CanvasStr, CanvasImg
-from pdf.utils import write_pdf
+from pdf.utils import write_pdf, Stages
+from pdf.utils.timing import file_size
 
 
 def text_width(string, font_name, font_size):
@@ -28,9 +31,21 @@ def split_str(string):
     return ' '.join(split[:len(split) // 2]), ' '.join(split[len(split) // 2:])
 
 
+def img_opacity(image, opacity):
+    """Reduce the opacity of an image path or PIL image in memory and return a reportlab ImageReader."""
+    im = image if isinstance(image, Image.Image) else Image.open(image)
+    im = im.convert('RGBA') if im.mode != 'RGBA' else im.copy()
+    if opacity is not None and 0 <= opacity <= 1:
+        alpha = ImageEnhance.Brightness(im.split()[3]).enhance(opacity)
+        im.putalpha(alpha)
+    return ImageReader(im)
+
+
 class DrawPDF:
-    def __init__(self, tempdir=None, compress=0, pagesize=LETTER):
-        if tempdir:
+    def __init__(self, tempdir=None, compress=0, pagesize=LETTER, in_memory=False, stages=None):
+        self.in_memory = in_memory
+        self.stages = stages if stages is not None else Stages()
+        if tempdir or in_memory:
             self.dir = tempdir
         else:
             self.dir = mkdtemp()
@@ -46,24 +61,34 @@ class DrawPDF:
 
     @property
     def dst(self):
-        if not self._dst:
+        if not self._dst and self.in_memory:
+            self._dst = io.BytesIO()
+        elif not self._dst:
             with NamedTemporaryFile(suffix='.pdf', dir=self.dir, delete=False) as tmppdf:
                 self._dst = resource_path(tmppdf.name)
         return self._dst
 
     def _write(self, output=None):
         self.packet.seek(0)  # move to the beginning of the StringIO buffer
-        output = output if output else self.dst
-        write_pdf(self.packet, output)  # Save new pdf file
-        return output
+
+        with self.stages.time('watermark write') as stage:
+            # Reportlab packet is already a complete PDF, no need to re-write it when working in memory
+            if self.in_memory and not output:
+                self._dst = self.packet
+            else:
+                output = output if output else self.dst
+                write_pdf(self.packet, output)  # Save new pdf file
+            stage['bytes_written'] += file_size(output or self._dst)
+        return output or self._dst
 
     def write(self, output=None):
         return self._write(output)
 
 
 class WatermarkDraw(DrawPDF):
-    def __init__(self, canvas_objects, rotate=0, compress=0, pagesize=LETTER, tempdir=None, pagescale=False):
-        super(WatermarkDraw, self).__init__(tempdir, compress, pagesize)
+    def __init__(self, canvas_objects, rotate=0, compress=0, pagesize=LETTER, tempdir=None, pagescale=False,
+                 in_memory=False, stages=None):
+        super(WatermarkDraw, self).__init__(tempdir, compress, pagesize, in_memory, stages)
         self.canvas_objects = canvas_objects
         self.rotate = rotate
 
@@ -82,25 +107,26 @@ class WatermarkDraw(DrawPDF):
         self.draw()
 
     def draw(self):
-        # Move canvas origin to the middle of the page
-        self.can.translate(self.can._pagesize[0] / 2, self.can._pagesize[1] / 2)
-
-        # Rotate canvas
-        self.can.rotate(self.rotate)
-
-        # Iterate canvas objects and determine if string or image
-        for obj in self.canvas_objects:
-            # Adjust x and y based on rotation
-            obj.x += int(self.rotate * 1.5)
-            obj.y += -int(self.rotate * 3)
-
-            # Check if CanvasObject is a string or image
-            if isinstance(obj, CanvasStr):
-                self._draw_string(obj)
-            elif isinstance(obj, CanvasImg):
-                self._draw_image(obj)
-        self.can.showPage()
-        self.can.save()
+        with self.stages.time('draw'):
+            # Move canvas origin to the middle of the page
+            self.can.translate(self.can._pagesize[0] / 2, self.can._pagesize[1] / 2)
+
+            # Rotate canvas
+            self.can.rotate(self.rotate)
+
+            # Iterate canvas objects and determine if string or image
+            for obj in self.canvas_objects:
+                # Adjust x and y based on rotation
+                obj.x += int(self.rotate * 1.5)
+                obj.y += -int(self.rotate * 3)
+
+                # Check if CanvasObject is a string or image
+                if isinstance(obj, CanvasStr):
+                    self._draw_string(obj)
+                elif isinstance(obj, CanvasImg):
+                    self._draw_image(obj)
+            self.can.showPage()
+            self.can.save()
 
     def _draw_image(self, ci):
         """
@@ -108,7 +134,11 @@ class WatermarkDraw(DrawPDF):
 
         :param ci: CanvasImage object
         """
-        img = img_adjust(ci.image, ci.opacity, tempdir=self.dir)
+        with self.stages.time('image', read=ci.image if isinstance(ci.image, str) else None):
+            if self.in_memory or isinstance(ci.image, Image.Image):
+                img = img_opacity(ci.image, ci.opacity)
+            else:
+                img = img_adjust(ci.image, ci.opacity, tempdir=self.dir)
         self.can.drawImage(img, x=ci.x, y=ci.y, width=ci.w, height=ci.h, mask=ci.mask,
                            preserveAspectRatio=ci.preserve_aspect_ratio, anchorAtXY=True)
 
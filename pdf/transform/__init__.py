@@ -1,6 +1,8 @@
 from pdf.transform.merge import Merge
+from pdf.transform.metadata import update_metadata
+from pdf.transform.orientation import normalize_orientation
 from pdf.transform.rotate import rotate
-from pdf.transform.slice import slicer
+from pdf.transform.slice import slicer, split
 from pdf.transform.upscale import upscale
 
-__all__ = ['rotate', 'upscale', 'slicer', 'Merge']
+__all__ = ['rotate', 'upscale', 'slicer', 'split', 'Merge', 'update_metadata', 'normalize_orientation']
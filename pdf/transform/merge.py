@@ -1,16 +1,145 @@
 # Merge PDF documents
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from itertools import chain
 
 from PyPDF3 import PdfFileMerger
-from pdfrw import PdfReader, PdfWriter, IndirectPdfDict
+from pdfrw import PdfReader, PdfWriter, IndirectPdfDict, PdfArray, PdfDict
+
+from pdf.utils.read import pdfrw_reader, pypdf3_reader
+from pdf.utils.stream import PdfStreamWriter, stream_fragment
+
+
+INFO = {
+    'Title': 'HPA Design',
+    'Author': 'HPA Design',
+    'Subject': 'HPA Design',
+    'Creator': 'HPA Design',
+}
+
+
+def dedup(pages):
+    """
+    Replace duplicate objects referenced by pdfrw pages with a single shared object.
+
+    Every indirect object reachable from the pages (fonts, images, form XObjects and their
+    streams) is hashed by its stream data and contents, with referenced objects hashed
+    recursively, and references to identical objects are rewritten to the first one found.
+    Pages themselves are never merged.
+
+    :param pages: List of pdfrw page objects
+    :return: Number of references rewritten
+    """
+    digests = {}
+    canonical = {}
+
+    def digest(obj):
+        if not isinstance(obj, (PdfDict, PdfArray)):
+            return '{0}:{1}'.format(type(obj).__name__, obj)
+        key = id(obj)
+        if key in digests:
+            # None while the object is being hashed (a reference cycle), which makes it unique
+            return digests[key] or 'cycle:{0}'.format(key)
+        if isinstance(obj, PdfDict) and obj.Type in ('/Page', '/Pages'):
+            digests[key] = 'page:{0}'.format(key)
+            for k, v in obj.iteritems():
+                if k != '/Parent':
+                    digest(v)
+            return digests[key]
+
+        digests[key] = None
+        h = sha1()
+        if isinstance(obj, PdfDict):
+            for k, v in sorted(obj.iteritems()):
+                if k != '/Length':
+                    h.update('{0}={1};'.format(k, digest(v)).encode())
+            if obj.stream is not None:
+                h.update(b'stream:' + obj.stream.encode('latin-1'))
+        else:
+            h.update('[{0}]'.format(','.join(digest(v) for v in obj)).encode())
+        digests[key] = h.hexdigest()
+        if obj.indirect:
+            canonical.setdefault(digests[key], obj)
+        return digests[key]
+
+    for page in pages:
+        digest(page)
+
+    rewritten = 0
+    seen = set()
+    stack = list(pages)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        items = obj.iteritems() if isinstance(obj, PdfDict) else enumerate(obj)
+        for k, v in list(items):
+            if isinstance(v, (PdfDict, PdfArray)):
+                shared = canonical.get(digests.get(id(v))) if v.indirect else None
+                if shared is not None and shared is not v:
+                    obj[k] = v = shared
+                    rewritten += 1
+                stack.append(v)
+    return rewritten
+
+
+def dedup_pdf(pdf, output=None):
+    """
+    Rewrite a PDF document with duplicate resources shared (see dedup).
+
+    :param pdf: PDF document path
+    :param output: Output path (overwrites pdf by default)
+    :return: Output path
+    """
+    reader = pdfrw_reader(pdf)
+    dedup(reader.pages)
+    output = output or pdf
+    PdfWriter(output, trailer=reader).write()
+    return output
 
 
 class Merge:
-    def __init__(self, input_pdfs, output_name='merged', output_dir=None, method='pdfrw'):
+    def __init__(self, input_pdfs, output_name='merged', output_dir=None, method='pdfrw', dedup=False, jobs=1):
+        """
+        Merge PDF documents into a single PDF document.
+
+        The 'stream' method writes each input's pages to the output as soon as the input is read
+        and only keeps one input open at a time, so memory use doesn't grow with the number of
+        inputs.  A generator of paths is consumed lazily by the 'stream' method.
+
+        When dedup is True, fonts, images and form XObjects that are identical across inputs are
+        written once and shared.  The 'pdfrw' method deduplicates before writing, the other
+        methods rewrite the merged document afterwards (which reads the whole merged document).
+
+        When jobs is greater than 1, inputs are parsed in that many worker processes and written
+        in their original order by the 'stream' method (the method is always 'stream').
+
+        :param input_pdfs: List or iterable of PDF paths, or a directory path
+        :param output_name: Output file name
+        :param output_dir: Output directory (directory of the first PDF by default)
+        :param method: PDF library to use ('pdfrw', 'pypdf3' or 'stream')
+        :param dedup: Share identical resources between inputs
+        :param jobs: Number of worker processes parsing inputs
+        """
         self.pdfs = self._get_pdf_list(input_pdfs)
-        self.directory = output_dir if output_dir else os.path.dirname(self.pdfs[0])
+        if not output_dir and not isinstance(self.pdfs, list):
+            # Peek at the first PDF without consuming it
+            first = next(self.pdfs, None)
+            if first is None:
+                raise ValueError('No PDF files to merge')
+            self.pdfs = chain([first], self.pdfs)
+            self.directory = os.path.dirname(first)
+        elif not output_dir and not self.pdfs:
+            raise ValueError('No PDF files to merge')
+        else:
+            self.directory = output_dir if output_dir else os.path.dirname(self.pdfs[0])
         self.output = os.path.join(self.directory, output_name.replace('.pdf', '') + '.pdf')
-        self.method = method
+        self.method = 'stream' if jobs > 1 else method
+        self.dedup = dedup
+        self.jobs = jobs
         self.file = self.merge(self.pdfs, self.output)
 
     def __str__(self):
@@ -28,19 +157,25 @@ class Merge:
         :param input_pdfs: List of PDFs or a directory path
              Directory - Scans directory contents
              List - Filters list to assert all list items are paths to PDF documents
-        :return: List of PDF paths
+             Iterable - Lazily filters items as they're consumed
+        :return: List of PDF paths (generator when given an iterable)
         """
         if isinstance(input_pdfs, list):
             return [pdf for pdf in input_pdfs if self.validate(pdf)]
-        elif os.path.isdir(input_pdfs):
+        elif isinstance(input_pdfs, str) and os.path.isdir(input_pdfs):
             return [os.path.join(input_pdfs, pdf) for pdf in os.listdir(input_pdfs) if self.validate(pdf)]
+        else:
+            return (pdf for pdf in input_pdfs if self.validate(pdf))
 
     def merge(self, pdf_files, output):
         """Merge list of PDF files to a single PDF file."""
         if self.method == 'pypdf3':
-            return self.pypdf3(pdf_files, output)
+            output = self.pypdf3(pdf_files, output)
+        elif self.method == 'stream':
+            output = self.stream(pdf_files, output, self.jobs)
         else:
-            return self.pdfrw(pdf_files, output)
+            return self.pdfrw(pdf_files, output, self.dedup)
+        return dedup_pdf(output) if self.dedup else output
 
     @staticmethod
     def pypdf3(pdf_files, output):
@@ -58,20 +193,43 @@ class Merge:
         return output
 
     @staticmethod
-    def pdfrw(pdf_files, output):
+    def pdfrw(pdf_files, output, dedup_resources=False):
         writer = PdfWriter()
-        for inpfn in pdf_files:
-            writer.addpages(PdfReader(inpfn).pages)
-
-        writer.trailer.Info = IndirectPdfDict(
-            Title='HPA Design',
-            Author='HPA Design',
-            Subject='HPA Design',
-            Creator='HPA Design',
-        )
+        pages = [page for inpfn in pdf_files for page in PdfReader(inpfn).pages]
+        if dedup_resources:
+            dedup(pages)
+        writer.addpages(pages)
+
+        writer.trailer.Info = IndirectPdfDict(**INFO)
         writer.write(output)
         return output
 
+    @staticmethod
+    def stream(pdf_files, output, jobs=1):
+        with PdfStreamWriter(output) as writer:
+            if jobs > 1:
+                # Parse inputs in worker processes, a bounded number of parsed inputs are pending
+                with ProcessPoolExecutor(jobs) as executor:
+                    pending = deque()
+                    for pdf in pdf_files:
+                        pending.append(executor.submit(stream_fragment, pdf))
+                        if len(pending) >= jobs * 2:
+                            writer.add_fragment(pending.popleft().result())
+                    while pending:
+                        writer.add_fragment(pending.popleft().result())
+            else:
+                for pdf in pdf_files:
+                    # Only the input being merged is open, its pages are written before the next is read
+                    with open(pdf, 'rb') as f:
+                        reader = pypdf3_reader(f)
+                        writer.register_pages(reader)
+                        for page_num in range(reader.getNumPages()):
+                            writer.add_page(reader.getPage(page_num), reader)
+                        writer.release(reader)
+
+            writer.close(info={'/' + k: v for k, v in INFO.items()})
+        return output
+
 
 def main():
     from pdf.gui.gui import get_directory
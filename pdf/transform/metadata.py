@@ -0,0 +1,37 @@
+# Update the document information of a pdf file
+import os
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+from pdf.utils.incremental import IncrementalWriter
+from pdf.utils.path import add_suffix
+
+
+def update_metadata(file_name, metadata, suffix='metadata', tempdir=None, in_memory=False, overwrite=False):
+    """
+    Update a PDF's document information (Title, Author, Subject...) with an incremental update.
+
+    Only the document information dictionary is appended to the document, no other objects are
+    rewritten.
+
+    :param file_name: PDF document path
+    :param metadata: Dictionary of document information (ex: {'Title': 'Plans', 'Author': 'HPA Design'})
+    :param suffix: Suffix added to the output file name
+    :param tempdir: Write output to a temporary file in this directory
+    :param in_memory: Write output to an in-memory stream
+    :param overwrite: Append the update to the document itself
+    :return: Output path or stream
+    """
+    if overwrite:
+        output = file_name
+    elif in_memory:
+        output = BytesIO()
+    elif tempdir:
+        with NamedTemporaryFile(suffix='.pdf', dir=tempdir, delete=False) as temp:
+            output = temp.name
+    else:
+        output = os.path.join(os.path.dirname(file_name), add_suffix(file_name, suffix))
+
+    with IncrementalWriter(file_name, output) as writer:
+        writer.update_info(metadata)
+        return writer.write()
@@ -0,0 +1,52 @@
+# Rotate the pages of a pdf file that don't match the document's orientation
+from PyPDF3 import PdfFileReader
+
+from pdf.transform.rotate import Rotate
+
+
+def page_geometry(reader):
+    """
+    Retrieve the visible width, height and rotation of every page.
+
+    :param reader: PdfFileReader object
+    :return: List of (width, height, rotate) tuples
+    """
+    rows = []
+    for page_number in range(reader.getNumPages()):
+        page = reader.getPage(page_number)
+        x0, y0, x1, y1 = (float(x) for x in page.cropBox)
+        rows.append((abs(x1 - x0), abs(y1 - y0), int(page.get('/Rotate', 0)) % 360))
+    return rows
+
+
+def misoriented(geometry, orientation=None):
+    """
+    Retrieve the indexes of pages that aren't displayed in an orientation.
+
+    :param geometry: Page geometry retrieved by page_geometry()
+    :param orientation: 'portrait' or 'landscape', by default the orientation of most pages
+    :return: List of page indexes
+    """
+    landscape = [(w > h) != (r % 180 == 90) for w, h, r in geometry]
+    target = sum(landscape) * 2 > len(landscape) if orientation is None else orientation == 'landscape'
+    return [i for i, shown in enumerate(landscape) if shown != target]
+
+
+def normalize_orientation(file_name, orientation=None, rotation=90, suffix='normalized', tempdir=None,
+                          method='incremental', in_memory=False, overwrite=False):
+    """
+    Rotate only the pages of a PDF document that aren't displayed in the same orientation.
+
+    :param file_name: PDF document path
+    :param orientation: 'portrait' or 'landscape', by default the orientation of most pages
+    :param rotation: Degrees misoriented pages are rotated clockwise (90 or 270)
+    :param suffix: Suffix added to the output file name
+    :param tempdir: Write output to a temporary file in this directory
+    :param method: Rotate method ('incremental', 'pdfrw' or 'pypdf3')
+    :param in_memory: Write output to an in-memory stream
+    :param overwrite: Replace the document with the normalized document
+    :return: Output path or stream
+    """
+    with open(file_name, 'rb') as f:
+        pages = misoriented(page_geometry(PdfFileReader(f)), orientation)
+    return Rotate(file_name, rotation, suffix, tempdir, method, in_memory, overwrite, pages).file
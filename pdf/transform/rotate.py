@@ -1,21 +1,48 @@
 # Rotate a pdf file
 import os
+from io import BytesIO
 from tempfile import NamedTemporaryFile
 
-from PyPDF3 import PdfFileReader, PdfFileWriter
-from pdfrw import PdfReader, PdfWriter
+from PyPDF3 import PdfFileWriter
+from PyPDF3.generic import NameObject, NumberObject
+from pdfrw import PdfWriter
 
+from pdf.utils.incremental import IncrementalWriter
 from pdf.utils.path import add_suffix
+from pdf.utils.read import pdfrw_reader, pypdf3_reader
+from pdf.utils.write import pypdf3_write
 
 
 class Rotate:
-    def __init__(self, file_name, rotation, suffix='rotated', tempdir=None, method='pdfrw'):
+    def __init__(self, file_name, rotation, suffix='rotated', tempdir=None, method='pdfrw', in_memory=False,
+                 overwrite=False, pages=None):
+        """
+        Rotate the pages of a PDF document by increments of 90 degrees.
+
+        The 'incremental' method only appends the rotated page objects to a copy of the document
+        (or to the document itself when overwrite is True) rather than rewriting every object.
+
+        :param file_name: PDF document path
+        :param rotation: Degrees to rotate clockwise (90, 180 or 270)
+        :param suffix: Suffix added to the output file name
+        :param tempdir: Write output to a temporary file in this directory
+        :param method: PDF library to use ('pdfrw', 'pypdf3' or 'incremental')
+        :param in_memory: Write output to an in-memory stream
+        :param overwrite: Replace the document with the rotated document
+        :param pages: Indexes of the pages to rotate (all pages by default)
+        """
         self.file_name = file_name
         self.rotation = rotation
+        self.pages = None if pages is None else set(pages)
         self.suffix = suffix
         self.tempdir = tempdir
+        self.in_memory = in_memory
 
-        if tempdir:
+        if overwrite:
+            self.outfn = file_name
+        elif in_memory:
+            self.outfn = BytesIO()
+        elif tempdir:
             with NamedTemporaryFile(suffix='.pdf', dir=tempdir, delete=False) as temp:
                 self.outfn = temp.name
         elif suffix:
@@ -25,34 +52,42 @@ class Rotate:
 
         if method == 'pypdf3':
             self.pypdf3()
+        elif method == 'incremental':
+            self.incremental()
         else:
             self.pdfrw()
 
     def __str__(self):
-        return self.file
+        return str(self.outfn)
 
     @property
     def file(self):
-        return str(self.outfn)
+        return self.outfn if self.in_memory else str(self.outfn)
 
     def pypdf3(self):
-        with open(self.file_name, 'rb') as pdf_in:
-            pdf_writer = PdfFileWriter()
-            pdf_reader = PdfFileReader(pdf_in)
-            for pagenum in range(pdf_reader.numPages):
-                page = pdf_reader.getPage(pagenum)
+        pdf_writer = PdfFileWriter()
+        pdf_reader = pypdf3_reader(self.file_name)
+        for pagenum in range(pdf_reader.numPages):
+            page = pdf_reader.getPage(pagenum)
+            if self.pages is None or pagenum in self.pages:
                 page.rotateClockwise(self.rotation)
-                pdf_writer.addPage(page)
+            pdf_writer.addPage(page)
+        return pypdf3_write(pdf_writer, self.outfn)
 
-            with open(self.outfn, 'wb') as pdf_out:
-                pdf_writer.write(pdf_out)
-        return self.outfn
+    def incremental(self):
+        with IncrementalWriter(self.file_name, self.outfn) as writer:
+            pdf_reader = writer.reader
+            for pagenum in range(pdf_reader.numPages) if self.pages is None else sorted(self.pages):
+                page = pdf_reader.getPage(pagenum)
+                page[NameObject('/Rotate')] = NumberObject((int(page.get('/Rotate', 0)) + self.rotation) % 360)
+                writer.update(page)
+            return writer.write()
 
     def pdfrw(self):
-        trailer = PdfReader(self.file_name)
+        trailer = pdfrw_reader(self.file_name)
         pages = trailer.pages
 
-        ranges = [[1, len(pages)]]
+        ranges = [[1, len(pages)]] if self.pages is None else [[pagenum + 1] for pagenum in sorted(self.pages)]
 
         for onerange in ranges:
             onerange = (onerange + onerange[-1:])[:2]
@@ -62,9 +97,12 @@ class Rotate:
         outdata = PdfWriter(self.outfn)
         outdata.trailer = trailer
         outdata.write()
+        if self.in_memory:
+            self.outfn.seek(0)
         return self.outfn
 
 
-def rotate(file_name, rotation, suffix='rotated', tempdir=None, method='pypdf3'):
+def rotate(file_name, rotation, suffix='rotated', tempdir=None, method='pypdf3', in_memory=False, overwrite=False,
+           pages=None):
     """Rotate PDF by increments of 90 degrees."""
-    return str(Rotate(file_name, rotation, suffix, tempdir, method))
+    return Rotate(file_name, rotation, suffix, tempdir, method, in_memory, overwrite, pages).file
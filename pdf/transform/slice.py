@@ -1,11 +1,15 @@
 # Slice PDF to remove unwanted pages
 import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from tempfile import NamedTemporaryFile
 
 from PyPDF3 import PdfFileReader, PdfFileWriter
+from PyPDF3.generic import ArrayObject, DictionaryObject, IndirectObject
 
-from pdf.utils.info import Info
 from pdf.utils.path import add_suffix
+from pdf.utils.read import pypdf3_reader
+from pdf.utils.stream import PdfStreamWriter
 
 
 def slicer(document, first_page=None, last_page=None, suffix='sliced', tempdir=None):
@@ -23,14 +27,14 @@ def slicer(document, first_page=None, last_page=None, suffix='sliced', tempdir=N
     # Reindex page selections for simple user input
     first_page = first_page - 1 if not None else None
 
+    pdf = PdfFileReader(document)
+    writer = PdfFileWriter()
+
     # Validate page range by comparing selection to number of pages in PDF document
-    pages = Info(document).pages
+    pages = pdf.getNumPages()
     invalid = 'Number of pages: ' + str(pages) + ' ----> Page Range Input: ' + str(first_page) + '-' + str(last_page)
     assert first_page <= last_page <= pages, invalid
 
-    pdf = PdfFileReader(document)
-    writer = PdfFileWriter()
-
     pages = list(range(pdf.getNumPages()))[first_page:last_page]
     for page in pages:
         writer.addPage(pdf.getPage(page))
@@ -38,3 +42,126 @@ def slicer(document, first_page=None, last_page=None, suffix='sliced', tempdir=N
     with open(output, 'wb') as out:
         writer.write(out)
     return output
+
+
+# Bytes written for each object besides its contents ('n 0 obj', 'endobj' and a cross-reference entry)
+OBJECT_OVERHEAD = 40
+
+
+def _references(obj, reader, found):
+    """Collect the references of every object a page depends on, other pages excluded."""
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in found:
+            return found
+        resolved = obj.getObject()
+        if isinstance(resolved, DictionaryObject) and resolved.get('/Type') == '/Page':
+            return found
+        found[key] = resolved
+        obj = resolved
+    if isinstance(obj, DictionaryObject):
+        for k, v in obj.items():
+            if k != '/Parent':
+                _references(v, reader, found)
+    elif isinstance(obj, ArrayObject):
+        for v in obj:
+            _references(v, reader, found)
+    return found
+
+
+def _serialized_size(obj):
+    data = BytesIO()
+    obj.writeToStream(data, None)
+    return len(data.getvalue()) + OBJECT_OVERHEAD
+
+
+def _size_ranges(reader, max_size):
+    """Group consecutive pages so each group's estimated output size is at most max_size bytes."""
+    sizes = {}
+    groups, current, written, total = [], [], set(), 0
+    for index in range(reader.getNumPages()):
+        page = reader.getPage(index)
+        refs = _references(DictionaryObject(page), reader, {})
+        for key, obj in refs.items():
+            if key not in sizes:
+                sizes[key] = _serialized_size(obj)
+        page_size = _serialized_size(DictionaryObject(page))
+
+        # Objects shared with pages already in the group are only written once
+        if current and total + page_size + sum(sizes[k] for k in refs if k not in written) > max_size:
+            groups.append(current)
+            current, written, total = [], set(), 0
+        total += page_size + sum(sizes[k] for k in refs if k not in written)
+        written.update(refs)
+        current.append(index)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _write_pages(reader, parts):
+    """Write page groups to their outputs, objects shared between groups are only parsed once."""
+    for output, pages in parts:
+        with PdfStreamWriter(output) as writer:
+            writer.register_pages(reader, pages)
+            for index in pages:
+                writer.add_page(reader.getPage(index), reader)
+    return [output for output, pages in parts]
+
+
+def _write_parts(job):
+    document, decrypt, parts = job
+    with open(document, 'rb') as f:
+        return _write_pages(pypdf3_reader(f, decrypt), parts)
+
+
+def split(document, ranges=None, every=None, max_size=None, suffix='part', output_dir=None, jobs=1, decrypt=None):
+    """
+    Split a PDF document into many PDF documents from a single parse of the document.
+
+    Pages are selected by exactly one of ranges, every or max_size.
+
+    :param document: PDF document path
+    :param ranges: List of (first_page, last_page) tuples, page numbers start at 1 and are inclusive
+    :param every: Number of pages in each output
+    :param max_size: Maximum size in bytes of each output (estimated, single pages may be larger)
+    :param suffix: Suffix appended to the document's file name, followed by the part's number
+    :param output_dir: Directory to save parts to (defaults to the document's directory)
+    :param jobs: Number of worker processes, each parses the document once and writes a share of parts
+    :param decrypt: Owner password to decrypt the document
+    :return: List of output paths, in page order
+    """
+    if sum(option is not None for option in (ranges, every, max_size)) != 1:
+        raise ValueError('Specify exactly one of ranges, every or max_size')
+
+    with open(document, 'rb') as f:
+        reader = pypdf3_reader(f, decrypt)
+        pages = reader.getNumPages()
+        if ranges is not None:
+            for first_page, last_page in ranges:
+                if not 1 <= first_page <= last_page <= pages:
+                    raise ValueError('Number of pages: {0} ----> Page Range Input: {1}-{2}'.format(
+                        pages, first_page, last_page))
+            groups = [list(range(first_page - 1, last_page)) for first_page, last_page in ranges]
+        elif every is not None:
+            groups = [list(range(i, min(i + every, pages))) for i in range(0, pages, every)]
+        else:
+            groups = _size_ranges(reader, max_size)
+
+        # Output paths
+        parts = []
+        for number, group in enumerate(groups, 1):
+            output = add_suffix(document, '{0}_{1}'.format(suffix, number))
+            if output_dir:
+                output = os.path.join(output_dir, os.path.basename(output))
+            parts.append((output, group))
+
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(parts)))
+        if jobs == 1:
+            # Reuse the objects parsed while grouping pages
+            return _write_pages(reader, parts)
+
+    size = -(-len(parts) // jobs)
+    chunks = [(document, decrypt, parts[i:i + size]) for i in range(0, len(parts), size)]
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        return [output for chunk in ex.map(_write_parts, chunks) for output in chunk]
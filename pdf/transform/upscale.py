@@ -1,25 +1,57 @@
 # Upscale a PDF file
 import os
+from io import BytesIO
 from tempfile import NamedTemporaryFile
 
 from PyPDF3 import PdfFileReader, PdfFileWriter
 from PyPDF3.pdf import PageObject
-from pdfrw import PdfReader, PdfWriter, PageMerge, IndirectPdfDict
+from pdfrw import PdfWriter, PageMerge, IndirectPdfDict, PdfArray
 
 from pdf.utils.info import Info
+from pdf.utils.matrix import box_size, fit_matrix
 from pdf.utils.path import add_suffix
+from pdf.utils.read import pdfrw_reader
+from pdf.utils.write import pypdf3_write
+
+
+# Page boxes transformed along with a page's contents by the 'fit' method
+PAGE_BOXES = ('/CropBox', '/BleedBox', '/TrimBox', '/ArtBox')
 
 
 class Upscale:
-    def __init__(self, file_name, margin_x=0, margin_y=0, scale=1.5, suffix='scaled', tempdir=None, method='pdfrw'):
+    def __init__(self, file_name, margin_x=0, margin_y=0, scale=1.5, suffix='scaled', tempdir=None, method='pdfrw',
+                 in_memory=False, size=None):
+        """
+        Scale the pages of a PDF document.
+
+        The 'pdfrw' and 'pypdf3' methods scale every page to the size of the first page times
+        scale.  The 'fit' method computes a transform for each page's own MediaBox (cached per
+        distinct page size), prepends a 'cm' operator to the page's contents and adjusts its page
+        boxes without re-wrapping the contents.  Pages are scaled by scale, or fit and centered
+        inside size (in the page's orientation) when a size is given.
+
+        :param file_name: PDF document path
+        :param margin_x: Horizontal margin
+        :param margin_y: Vertical margin
+        :param scale: Scale factor
+        :param suffix: Suffix added to the output file name
+        :param tempdir: Write output to a temporary file in this directory
+        :param method: PDF library to use ('pdfrw', 'pypdf3' or 'fit'), always 'fit' when size is given
+        :param in_memory: Write output to an in-memory stream
+        :param size: Target page width and height (ex: reportlab.lib.pagesizes.letter)
+        """
         self.file_name = file_name
         self.margin_x = margin_x
         self.margin_y = margin_y
         self.scale = scale
+        self.size = size
         self.suffix = suffix
+        self.in_memory = in_memory
 
         # Set output file name
-        if tempdir:
+        if in_memory:
+            self.output = BytesIO()
+        elif tempdir:
             with NamedTemporaryFile(suffix='_' + suffix + '.pdf', dir=tempdir, delete=False) as temp:
                 self.output = temp.name
         elif suffix:
@@ -27,6 +59,11 @@ class Upscale:
         else:
             self.output = NamedTemporaryFile(suffix='_' + suffix + '.pdf').name
 
+        # Per-page transforms don't depend on the first page's size
+        if size or method == 'fit':
+            self.fit()
+            return
+
         # Get target width and height
         dims = Info(self.file_name).dimensions
         self.target_w = dims['w'] * self.scale
@@ -43,7 +80,7 @@ class Upscale:
 
     @property
     def file(self):
-        return str(self.output)
+        return self.output if self.in_memory else str(self.output)
 
     def _pdfrw_adjust(self, page):
         info = PageMerge().add(page)
@@ -54,12 +91,71 @@ class Upscale:
         return page.render()
 
     def pdfrw(self):
-        reader = PdfReader(self.file_name)
+        reader = pdfrw_reader(self.file_name)
         writer = PdfWriter(self.output)
         for i in list(range(0, len(reader.pages))):
             writer.addpage(self._pdfrw_adjust(reader.pages[i]))
         writer.trailer.Info = IndirectPdfDict(reader.Info or {})
         writer.write()
+        if self.in_memory:
+            self.output.seek(0)
+
+    def _fit_transform(self, mbox):
+        """Retrieve the matrix and page size that scale a MediaBox to the target size."""
+        width, height = box_size(mbox)
+        if self.size:
+            target_w, target_h = self.size
+            if (width > height) != (target_w > target_h):
+                target_w, target_h = target_h, target_w
+            dst = (self.margin_x, self.margin_y, target_w - self.margin_x, target_h - self.margin_y)
+            return fit_matrix(mbox, dst, rotate=0), (target_w, target_h)
+        target_w, target_h = width * self.scale, height * self.scale
+        dst = (self.margin_x, self.margin_y, target_w - self.margin_x, target_h - self.margin_y)
+        return fit_matrix(mbox, dst, rotate=0, scale=self.scale), (target_w, target_h)
+
+    def fit(self):
+        reader = pdfrw_reader(self.file_name)
+        restore = IndirectPdfDict(stream='\nQ')
+        transforms = {}
+        mapped = set()
+        for page in reader.pages:
+            mbox = tuple(float(x) for x in page.inheritable.MediaBox)
+
+            # One transform and 'cm' content stream per distinct page size
+            if mbox not in transforms:
+                matrix, (w, h) = self._fit_transform(mbox)
+                cm = IndirectPdfDict(stream='q {0} cm\n'.format(' '.join('{0:f}'.format(x) for x in matrix)))
+                transforms[mbox] = matrix, cm, PdfArray([0, 0, w, h])
+            (a, b, c, d, e, f), cm, media_box = transforms[mbox]
+
+            contents = page.Contents
+            contents = list(contents) if isinstance(contents, PdfArray) else [contents] if contents else []
+            page.Contents = PdfArray([cm] + contents + [restore])
+            page.MediaBox = media_box
+            for key in PAGE_BOXES:
+                box = page.inheritable.CropBox if key == '/CropBox' else page[key]
+                if box:
+                    x0, y0, x1, y1 = (float(x) for x in box)
+                    page[key] = PdfArray([a * x0 + e, d * y0 + f, a * x1 + e, d * y1 + f])
+
+            # Move links and form widgets with the page's contents, shared annotations are mapped once
+            for annot in page.Annots or []:
+                if id(annot) in mapped:
+                    continue
+                mapped.add(id(annot))
+                if annot.Rect:
+                    x0, y0, x1, y1 = (float(x) for x in annot.Rect)
+                    annot.Rect = PdfArray([a * x0 + e, d * y0 + f, a * x1 + e, d * y1 + f])
+                if annot.QuadPoints:
+                    points = [float(x) for x in annot.QuadPoints]
+                    annot.QuadPoints = PdfArray([a * x + e if i % 2 == 0 else d * x + f
+                                                 for i, x in enumerate(points)])
+
+        writer = PdfWriter(self.output)
+        writer.trailer = reader
+        writer.write()
+        if self.in_memory:
+            self.output.seek(0)
 
     def pypdf3(self):
         reader = PdfFileReader(self.file_name)
@@ -75,10 +171,9 @@ class Upscale:
             page.mergeScaledTranslatedPage(wtrmrk, self.scale, self.margin_x, self.margin_y)
             writer.addPage(page)
 
-        with open(self.output, "wb") as outputStream:
-            writer.write(outputStream)
-        return self.output
+        return pypdf3_write(writer, self.output)
 
 
-def upscale(file_name, margin_x=0, margin_y=0, scale=1.5, suffix='scaled', tempdir=None, method='pdfrw'):
-    return str(Upscale(file_name, margin_x, margin_y, scale, suffix, tempdir, method))
+def upscale(file_name, margin_x=0, margin_y=0, scale=1.5, suffix='scaled', tempdir=None, method='pdfrw',
+            in_memory=False, size=None):
+    return Upscale(file_name, margin_x, margin_y, scale, suffix, tempdir, method, in_memory, size).file
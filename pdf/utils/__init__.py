@@ -2,9 +2,12 @@ from pdf.utils.info import Info
 from pdf.utils.path import set_destination, add_suffix
 from pdf.utils.receipt import Receipt
 from pdf.utils.view import open_window
-from pdf.utils.write import overlay_pdfs, write_pdf
-from pdf.utils.read import pypdf3_reader
+from pdf.utils.write import overlay_pdfs, write_pdf, pypdf3_write
+from pdf.utils.read import pypdf3_reader, pdfrw_reader, fitz_reader
+from pdf.utils.matrix import fit, fit_matrix, multiply
+from pdf.utils.timing import Stages
 
 
 __all__ = ['set_destination', 'add_suffix', 'open_window', 'overlay_pdfs', 'write_pdf', 'Info', 'Receipt',
-           'pypdf3_reader']
+           'pypdf3_reader', 'pdfrw_reader', 'fitz_reader', 'pypdf3_write', 'fit', 'fit_matrix', 'multiply',
+           'Stages']
@@ -0,0 +1,129 @@
+# Store cached files in a directory shared by multiple processes
+import hashlib
+import os
+import shutil
+from tempfile import mkstemp
+
+
+class FileCache:
+    # Extension of cached files, other files in the directory are ignored
+    ext = '.cache'
+
+    def __init__(self, directory=None, max_files=None, max_bytes=None):
+        """
+        On-disk store of files named by their cache key.
+
+        Files are written to a temp file and renamed so other processes never read a partial file.
+        Reading a file marks it as recently used, when the store holds more than max_files files
+        or max_bytes bytes the least recently used files are removed.
+
+        :param directory: str
+            Directory of the on-disk store (disabled when None)
+        :param max_files: int
+            Maximum number of files kept in the store (unlimited when None)
+        :param max_bytes: int
+            Maximum total size of files kept in the store (unlimited when None)
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._file_digests = {}
+
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.ext)
+
+    def _entries(self):
+        if not self.directory:
+            return []
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(self.ext)]
+
+    def _file_digest(self, path):
+        """Retrieve a hash of a file's contents, memoized by path, size and modification time."""
+        stat = os.stat(path)
+        signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._file_digests.get(signature)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = self._file_digests[signature] = sha.hexdigest()
+        return digest
+
+    def _touch(self, key):
+        """Retrieve a cached file's path marked as recently used, or None on a miss."""
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            # Mark as recently used so eviction removes the least recently used files
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _read(self, key):
+        """Retrieve a cached file's bytes, or None on a miss."""
+        path = self._touch(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _copy(self, key, output):
+        """Copy a cached file to an output path, return the output or None on a miss."""
+        path = self._touch(key)
+        if path is None:
+            return None
+        try:
+            shutil.copyfile(path, output)
+        except FileNotFoundError:
+            return None
+        return output
+
+    def _write(self, key, data=None, source=None):
+        """Store bytes, or a copy of a source file."""
+        fd, tmp = mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            if source is None:
+                f.write(data)
+            else:
+                with open(source, 'rb') as src:
+                    shutil.copyfileobj(src, f)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        if self.max_files is None and self.max_bytes is None:
+            return
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        count, total = len(entries), sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if (self.max_files is None or count <= self.max_files) and \
+                    (self.max_bytes is None or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            count, total = count - 1, total - size
+
+    def _clear_files(self):
+        for path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
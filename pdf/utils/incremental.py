@@ -0,0 +1,161 @@
+# Append changed objects to a PDF file as an incremental update instead of rewriting it
+import os
+import shutil
+
+from PyPDF3 import PdfFileReader
+from PyPDF3.generic import DictionaryObject, IndirectObject, NameObject, NumberObject, createStringObject
+
+
+def startxref(pdf_file):
+    """Retrieve the offset of the last cross-reference section from the end of an open PDF file."""
+    pdf_file.seek(0, os.SEEK_END)
+    pdf_file.seek(max(pdf_file.tell() - 1024, 0))
+    tail = pdf_file.read()
+    return int(tail[tail.rindex(b'startxref') + 9:].split()[0])
+
+
+class IncrementalWriter:
+    def __init__(self, pdf, output=None):
+        """
+        Update objects of a PDF document by appending them after its original contents.
+
+        Only the changed objects, a cross-reference section for them and a trailer pointing
+        to the previous cross-reference section are written, so the cost of an update doesn't
+        depend on the size of the document.  Objects are read lazily from the document.
+
+        :param pdf: PDF document path
+        :param output: Output path or writable binary stream, the original contents are copied to it
+            (appends to pdf by default)
+        """
+        self.pdf = pdf
+        self.output = output
+        self._file = open(pdf, 'rb')
+        self.reader = PdfFileReader(self._file)
+        if self.reader.isEncrypted:
+            self._file.close()
+            raise ValueError('Incremental updates of encrypted PDF documents are not supported')
+        self._prev = startxref(self._file)
+        self._next = int(self.reader.trailer['/Size'])
+        self._objects = {}
+        self._info = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+        return False
+
+    def update(self, obj, ref=None):
+        """
+        Replace an object of the document.
+
+        :param obj: Changed object (ex: a PageObject)
+        :param ref: Indirect reference to the object being replaced (obj.indirectRef by default)
+        :return: Indirect reference
+        """
+        ref = ref or obj.indirectRef
+        self._objects[ref.idnum] = (ref.generation, obj)
+        return ref
+
+    def add_object(self, obj):
+        """Add a new object to the document and return an indirect reference to it."""
+        ref = IndirectObject(self._next, 0, self.reader)
+        self._next += 1
+        return self.update(obj, ref)
+
+    def update_info(self, info):
+        """
+        Merge values into the document information dictionary.
+
+        :param info: Dictionary of document information (ex: {'/Title': 'Plans'} or {'Title': 'Plans'})
+        :return: Indirect reference to the document information dictionary
+        """
+        ref = self.reader.trailer.raw_get('/Info') if '/Info' in self.reader.trailer else None
+        updated = DictionaryObject(ref.getObject() if isinstance(ref, IndirectObject) else {})
+        for key, value in info.items():
+            key = key if key.startswith('/') else '/' + key
+            updated[NameObject(key)] = createStringObject(value) if isinstance(value, str) else value
+        self._info = self.update(updated, ref) if isinstance(ref, IndirectObject) else self.add_object(updated)
+        return self._info
+
+    def _open_output(self):
+        if self.output is None or self.output == self.pdf:
+            return open(self.pdf, 'ab')
+        elif hasattr(self.output, 'write'):
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, self.output)
+            return self.output
+        else:
+            shutil.copyfile(self.pdf, self.output)
+            return open(self.output, 'ab')
+
+    def _rollback(self, stream, start):
+        """Discard a partially written update, leaving the output as it was before write()."""
+        if self.output is None or self.output == self.pdf:
+            stream.truncate(start)
+        elif hasattr(self.output, 'write'):
+            if hasattr(self.output, 'truncate'):
+                self.output.seek(start)
+                self.output.truncate()
+        else:
+            stream.close()
+            os.remove(self.output)
+
+    def write(self):
+        """
+        Append the changed objects, cross-reference section and trailer.
+
+        :return: Output path or stream
+        """
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(self._next),
+            NameObject('/Root'): self.reader.trailer.raw_get('/Root'),
+            NameObject('/Prev'): NumberObject(self._prev),
+        })
+        for key in ('/Info', '/ID'):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+        if self._info is not None:
+            trailer[NameObject('/Info')] = self._info
+
+        start = self.output.tell() if hasattr(self.output, 'tell') else os.path.getsize(self.pdf)
+        stream = None
+        try:
+            stream = self._open_output()
+            stream.write(b'\n')
+            offsets = {}
+            for idnum in sorted(self._objects):
+                generation, obj = self._objects[idnum]
+                offsets[idnum] = stream.tell()
+                stream.write('{0} {1} obj\n'.format(idnum, generation).encode())
+                obj.writeToStream(stream, None)
+                stream.write(b'\nendobj\n')
+
+            # One cross-reference subsection per run of consecutive object numbers
+            xref = stream.tell()
+            stream.write(b'xref\n0 1\n0000000000 65535 f \n')
+            numbers = [idnum for idnum in sorted(offsets) if idnum]
+            start = 0
+            for i in range(1, len(numbers) + 1):
+                if i == len(numbers) or numbers[i] != numbers[i - 1] + 1:
+                    stream.write('{0} {1}\n'.format(numbers[start], i - start).encode())
+                    for idnum in numbers[start:i]:
+                        stream.write('{0:010d} {1:05d} n \n'.format(offsets[idnum],
+                                                                    self._objects[idnum][0]).encode())
+                    start = i
+            stream.write(b'trailer\n')
+            trailer.writeToStream(stream, None)
+            stream.write('\nstartxref\n{0}\n%%EOF\n'.format(xref).encode())
+        except BaseException:
+            if stream is not None:
+                self._rollback(stream, start)
+            raise
+        finally:
+            self._file.close()
+            if stream is not None and stream is not self.output:
+                stream.close()
+
+        if hasattr(self.output, 'seek'):
+            self.output.seek(0)
+        return self.pdf if self.output is None else self.output
@@ -0,0 +1,87 @@
+# Compute PDF transformation matrices
+from math import cos, sin, radians
+
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+
+def multiply(m1, m2):
+    """
+    Multiply two PDF transformation matrices.
+
+    :param m1: Matrix [a b c d e f] applied first
+    :param m2: Matrix [a b c d e f] applied second
+    :return: Concatenated matrix
+    """
+    a1, b1, c1, d1, e1, f1 = (float(i) for i in m1)
+    a2, b2, c2, d2, e2, f2 = (float(i) for i in m2)
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+
+def box_size(box):
+    """Retrieve the width and height of a PDF box [x0 y0 x1 y1]."""
+    return abs(float(box[2]) - float(box[0])), abs(float(box[3]) - float(box[1]))
+
+
+def box_center(box):
+    """Retrieve the middle point of a PDF box [x0 y0 x1 y1]."""
+    return (float(box[0]) + float(box[2])) / 2, (float(box[1]) + float(box[3])) / 2
+
+
+def fit(src, dst, rotate=None):
+    """
+    Retrieve the rotation and scale needed to fit a source box inside a destination box.
+
+    :param src: Box [x0 y0 x1 y1] to be placed
+    :param dst: Box [x0 y0 x1 y1] to be placed in
+    :param rotate: Clockwise degrees (increments of 90), by default 90 when orientations differ
+    :return: Rotation and scale
+    """
+    src_w, src_h = box_size(src)
+    dst_w, dst_h = box_size(dst)
+    if rotate is None:
+        rotate = 90 if (src_w > src_h) != (dst_w > dst_h) else 0
+    if rotate % 180:
+        src_w, src_h = src_h, src_w
+    return rotate, min(dst_w / src_w, dst_h / src_h)
+
+
+def fit_matrix(src, dst, rotate=None, scale=None):
+    """
+    Create a matrix that rotates, scales and centers a source box inside a destination box.
+
+    :param src: Box [x0 y0 x1 y1] to be placed
+    :param dst: Box [x0 y0 x1 y1] to be placed in
+    :param rotate: Clockwise degrees (increments of 90), by default 90 when orientations differ
+    :param scale: Scale factor, by default the largest scale that fits src inside dst
+    :return: Matrix [a b c d e f]
+    """
+    _rotate, _scale = fit(src, dst, rotate)
+    scale = _scale if scale is None else scale
+    theta = radians(-_rotate)
+    a, b = round(scale * cos(theta), 12), round(scale * sin(theta), 12)
+    c, d = -b, a
+
+    # Translate so the center of src lands on the center of dst
+    src_x, src_y = box_center(src)
+    dst_x, dst_y = box_center(dst)
+    return a, b, c, d, dst_x - (a * src_x + c * src_y), dst_y - (b * src_x + d * src_y)
+
+
+def fit_page_matrix(src, mbox, rotate=0):
+    """
+    Create a matrix that fits a source box to a page as it's displayed with its /Rotate.
+
+    The source is rotated to fit the displayed page, then counter-rotated by the page's rotation so
+    it's drawn the same way as on an unrotated page of the displayed size.
+
+    :param src: Box [x0 y0 x1 y1] to be placed
+    :param mbox: Page MediaBox [x0 y0 x1 y1]
+    :param rotate: Page rotation (/Rotate, clockwise degrees)
+    :return: Matrix [a b c d e f]
+    """
+    width, height = box_size(mbox)
+    displayed = (0, 0, height, width) if rotate % 180 else (0, 0, width, height)
+    return fit_matrix(src, mbox, rotate=(fit(src, displayed)[0] - rotate) % 360)
@@ -0,0 +1,29 @@
+# Measure memory use of the current process
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _statm(field):
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[field]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def peak_memory_usage():
+    """Retrieve the peak resident set size of this process in megabytes, or None if unsupported."""
+    if resource is None:
+        return None
+    # Reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def memory_usage():
+    """Retrieve the current resident set size of this process in megabytes, or None if unsupported."""
+    try:
+        return _statm(1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_memory_usage()
@@ -1,4 +1,6 @@
+import fitz
 from PyPDF3 import PdfFileReader
+from pdfrw import PdfReader
 
 
 def pypdf3_reader(pdf, decrypt=None):
@@ -15,3 +17,30 @@ def pypdf3_reader(pdf, decrypt=None):
         return reader
     else:
         return PdfFileReader(pdf)
+
+
+def pdfrw_reader(pdf, **kwargs):
+    """
+    Retrieve a pdfrw PdfReader object from a PDF file path or an in-memory stream.
+
+    pdfrw reads file-like objects from their current position, so streams are rewound first.
+
+    :param pdf: PDF document path or readable stream (ex: io.BytesIO)
+    :return: PdfReader object
+    """
+    if hasattr(pdf, 'seek'):
+        pdf.seek(0)
+    return PdfReader(pdf, **kwargs)
+
+
+def fitz_reader(pdf):
+    """
+    Retrieve a PyMuPDF Document object from a PDF file path or an in-memory stream.
+
+    :param pdf: PDF document path or readable stream (ex: io.BytesIO)
+    :return: fitz.Document object
+    """
+    if hasattr(pdf, 'read'):
+        pdf.seek(0)
+        return fitz.open(stream=pdf.read(), filetype='pdf')
+    return fitz.open(pdf)
@@ -43,13 +43,14 @@ class Receipt:
         self.items.append(message)
 
     def dump(self):
-        exists = os.path.isfile(self.dst)
-        with open(self.dst, 'a') as f:
-            if exists:
-                f.write('*******************************************************************\n')
-
-            for item in self.items:
-                f.write(item + '\n')
+        if self.dst:
+            exists = os.path.isfile(self.dst)
+            with open(self.dst, 'a') as f:
+                if exists:
+                    f.write('*******************************************************************\n')
+
+                for item in self.items:
+                    f.write(item + '\n')
 
         if self.gui and 'PySimpleGUI' in modules:
             sg.Popup('Success!')
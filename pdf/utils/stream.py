@@ -0,0 +1,315 @@
+# Write PDF objects to a file as pages are added instead of holding the whole document in memory
+import copy
+import os
+import re
+from collections import deque
+from io import BytesIO
+
+from PyPDF3.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject,
+                            NullObject, NumberObject, StreamObject, createStringObject)
+
+from pdf.utils.read import pypdf3_reader
+
+
+def stream_data(page):
+    """Retrieve the decoded content stream data of a PyPDF3 page."""
+    contents = page.get('/Contents')
+    if contents is None:
+        return b''
+    contents = contents.getObject()
+    if isinstance(contents, ArrayObject):
+        return b'\n'.join(c.getObject().getData() for c in contents)
+    return contents.getData()
+
+
+class _FragmentRef(IndirectObject):
+    """Indirect reference written as a placeholder that is renumbered when the fragment is added."""
+    def writeToStream(self, stream, encryption_key):
+        stream.write(self.pdf.marker + str(self.idnum).encode() + b'\x00')
+
+
+class PdfStreamWriter:
+    def __init__(self, output, version='1.4'):
+        """
+        Incrementally write pages read with PyPDF3 to a PDF file.
+
+        Every object a page references is written as soon as the page is added, only the
+        object offsets are kept until the cross-reference table is written by close().  Object
+        numbers 1 and 2 are reserved for the document catalog and page tree.
+
+        :param output: Output file path or writable binary stream
+        :param version: PDF version written to the file header
+        """
+        self.output = output
+        self._stream = output if hasattr(output, 'write') else open(output, 'wb')
+        self._offsets = {}
+        self._refs = {}
+        self._pages = {}
+        self._kids = []
+        self._next = 3
+        self._queue = deque()
+        self._closed = False
+        self._stream.write('%PDF-{0}\n'.format(version).encode() + b'%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            if not self._closed:
+                self.close()
+        elif self._stream is not self.output:
+            self._stream.close()
+
+    def __len__(self):
+        return len(self._kids)
+
+    def _reserve(self):
+        num = self._next
+        self._next += 1
+        return num
+
+    def _ref(self, num):
+        return IndirectObject(num, 0, self)
+
+    def _translate(self, obj, reader):
+        """Copy a direct object, renumbering indirect references into this writer's numbering."""
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is self:
+                return obj
+            key = (id(reader), obj.idnum, obj.generation)
+            if key in self._pages:
+                return self._ref(self._pages[key])
+            if key not in self._refs:
+                resolved = obj.getObject()
+                # Pages that are not being written are replaced with null
+                if isinstance(resolved, DictionaryObject) and resolved.get('/Type') == '/Page':
+                    return NullObject()
+                self._refs[key] = self._reserve()
+                self._queue.append((self._refs[key], resolved, reader))
+            return self._ref(self._refs[key])
+        elif isinstance(obj, DictionaryObject):
+            new = copy.copy(obj)
+            for k, v in obj.items():
+                if not (k == '/Length' and isinstance(obj, StreamObject)):
+                    new[k] = self._translate(v, reader)
+            return new
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self._translate(v, reader) for v in obj)
+        return obj
+
+    def _write(self, num, obj):
+        self._offsets[num] = self._stream.tell()
+        self._stream.write('{0} 0 obj\n'.format(num).encode())
+        obj.writeToStream(self._stream, None)
+        self._stream.write(b'\nendobj\n')
+
+    def _drain(self):
+        """Write every object referenced but not yet written."""
+        while self._queue:
+            num, obj, reader = self._queue.popleft()
+            self._write(num, self._translate(obj, reader))
+
+    def register_pages(self, reader, pages=None):
+        """
+        Reserve object numbers for pages that will be added from a reader.
+
+        References between registered pages (links, annotations) are preserved, references to
+        pages that are not registered are replaced with null.
+
+        :param reader: PdfFileReader object
+        :param pages: Page indexes to be added (all pages by default)
+        """
+        pages = range(reader.getNumPages()) if pages is None else pages
+        for index in pages:
+            ref = reader.getPage(index).indirectRef
+            if ref is not None:
+                self._pages.setdefault((id(reader), ref.idnum, ref.generation), self._reserve())
+
+    def add_object(self, obj, reader=None):
+        """Write a new object (and any objects it references) and return an indirect reference to it."""
+        num = self._reserve()
+        self._write(num, self._translate(obj, reader))
+        self._drain()
+        return self._ref(num)
+
+    def add_stream(self, data, compress=False):
+        """Write a content stream and return an indirect reference to it."""
+        stream = DecodedStreamObject()
+        stream.setData(data)
+        return self.add_object(stream.flateEncode() if compress else stream)
+
+    def add_form(self, page, reader, compress=True):
+        """Write a page as a Form XObject and return an indirect reference to it."""
+        form = DecodedStreamObject()
+        form.setData(stream_data(page))
+        form = form.flateEncode() if compress else form
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): page.mediaBox,
+            NameObject('/Resources'): page.get('/Resources', DictionaryObject()),
+        })
+        return self.add_object(form, reader)
+
+    def add_page(self, page, reader, before=(), after=(), xobjects=None):
+        """
+        Write a page and every object it references.
+
+        :param page: PageObject
+        :param reader: PdfFileReader the page belongs to
+        :param before: Content stream references drawn before the page's contents
+        :param after: Content stream references drawn after the page's contents
+        :param xobjects: Dictionary of XObject names and references added to the page's resources
+        """
+        ref = getattr(page, 'indirectRef', None)
+        page = DictionaryObject(page)
+        page[NameObject('/Parent')] = self._ref(2)
+
+        if before or after:
+            contents = page.get('/Contents', ArrayObject())
+            if not isinstance(contents, ArrayObject):
+                contents = ArrayObject([contents]) if not isinstance(contents.getObject(), ArrayObject) \
+                    else contents.getObject()
+            page[NameObject('/Contents')] = ArrayObject(list(before) + list(contents) + list(after))
+
+        if xobjects:
+            resources = DictionaryObject(page.get('/Resources', DictionaryObject()).getObject())
+            xobject = DictionaryObject(resources.get('/XObject', DictionaryObject()).getObject())
+            xobject.update({NameObject(k): v for k, v in xobjects.items()})
+            resources[NameObject('/XObject')] = xobject
+            page[NameObject('/Resources')] = resources
+
+        key = (id(reader), ref.idnum, ref.generation) if ref is not None else None
+        num = self._pages[key] if key in self._pages else self._reserve()
+        self._write(num, self._translate(page, reader))
+        self._drain()
+        self._kids.append(num)
+        return self._ref(num)
+
+    def add_fragment(self, fragment):
+        """
+        Write pages serialized by stream_fragment(), renumbering their objects.
+
+        :param fragment: Tuple returned by stream_fragment()
+        :return: Number of pages added
+        """
+        marker, objects, kids, count = fragment
+        base = self._next - 3
+        self._next += count - 3
+
+        def renumber(match):
+            num = int(match.group(1))
+            return '{0} 0 R'.format(num if num < 3 else num + base).encode()
+
+        placeholder = re.compile(re.escape(marker) + rb'(\d+)\x00')
+        for num, data in objects:
+            self._offsets[num + base] = self._stream.tell()
+            self._stream.write('{0} 0 obj\n'.format(num + base).encode())
+            self._stream.write(placeholder.sub(renumber, data))
+            self._stream.write(b'\nendobj\n')
+        self._kids.extend(num + base for num in kids)
+        return len(kids)
+
+    def flush(self, reader=None):
+        """Flush written objects to the output and release the reader's cache of resolved objects."""
+        self._stream.flush()
+        if reader is not None:
+            reader.resolvedObjects.clear()
+
+    def release(self, reader):
+        """
+        Forget every object read from a reader once all of its pages have been added.
+
+        References to the reader's objects can no longer be resolved to objects that were
+        already written, so only release readers that won't be used again.
+        """
+        key = id(reader)
+        self._refs = {k: v for k, v in self._refs.items() if k[0] != key}
+        self._pages = {k: v for k, v in self._pages.items() if k[0] != key}
+        self.flush(reader)
+
+    def close(self, info=None, catalog=None, reader=None):
+        """
+        Write the page tree, catalog, cross-reference table and trailer.
+
+        :param info: Dictionary of document information (ex: {'/Producer': 'pdfconduit'})
+        :param catalog: Dictionary of document catalog entries (ex: '/Outlines', '/AcroForm') copied from reader
+        :param reader: PdfFileReader info and catalog objects are read from
+        :return: Output
+        """
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(self._ref(k) for k in self._kids),
+            NameObject('/Count'): NumberObject(len(self._kids)),
+        })
+        self._write(2, pages)
+        root = DictionaryObject({NameObject('/Type'): NameObject('/Catalog'), NameObject('/Pages'): self._ref(2)})
+        for k, v in (catalog or {}).items():
+            if k not in ('/Type', '/Pages'):
+                root[NameObject(k)] = self._translate(v, reader)
+        self._write(1, root)
+        self._drain()
+
+        trailer = DictionaryObject({NameObject('/Root'): self._ref(1)})
+        if info:
+            info = DictionaryObject({NameObject(k): createStringObject(v) if isinstance(v, str) else v
+                                     for k, v in info.items()})
+            trailer[NameObject('/Info')] = self.add_object(info, reader)
+
+        # Registered pages that were never added are written as free entries
+        xref = self._stream.tell()
+        self._stream.write('xref\n0 {0}\n'.format(self._next).encode())
+        self._stream.write(b'0000000000 65535 f \n')
+        for num in range(1, self._next):
+            if num in self._offsets:
+                self._stream.write('{0:010d} 00000 n \n'.format(self._offsets[num]).encode())
+            else:
+                self._stream.write(b'0000000000 00000 f \n')
+        trailer[NameObject('/Size')] = NumberObject(self._next)
+        self._stream.write(b'trailer\n')
+        trailer.writeToStream(self._stream, None)
+        self._stream.write('\nstartxref\n{0}\n%%EOF\n'.format(xref).encode())
+
+        self._closed = True
+        if self._stream is self.output:
+            self._stream.seek(0)
+        else:
+            self._stream.close()
+        return self.output
+
+
+class _FragmentWriter(PdfStreamWriter):
+    """Serialize objects to memory with placeholder references instead of writing a PDF file."""
+    def __init__(self):
+        super(_FragmentWriter, self).__init__(BytesIO())
+        self.marker = b'\x00ref' + os.urandom(8).hex().encode() + b':'
+        self.objects = []
+
+    def _ref(self, num):
+        return _FragmentRef(num, 0, self)
+
+    def _write(self, num, obj):
+        data = BytesIO()
+        obj.writeToStream(data, None)
+        self.objects.append((num, data.getvalue()))
+
+
+def stream_fragment(pdf, decrypt=None):
+    """
+    Parse a PDF document and serialize its pages for PdfStreamWriter.add_fragment().
+
+    Fragments only contain bytes and numbers so documents can be parsed in worker processes
+    while a single PdfStreamWriter adds them to the output in order.
+
+    :param pdf: PDF document path
+    :param decrypt: Owner password to decrypt pdf
+    :return: Tuple of the reference placeholder, serialized objects, page numbers and object count
+    """
+    writer = _FragmentWriter()
+    with open(pdf, 'rb') as f:
+        reader = pypdf3_reader(f, decrypt)
+        writer.register_pages(reader)
+        for page_num in range(reader.getNumPages()):
+            writer.add_page(reader.getPage(page_num), reader)
+    return writer.marker, writer.objects, writer._kids, writer._next
@@ -0,0 +1,73 @@
+# Record elapsed time and bytes read and written by each stage of a process
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+
+def file_size(pdf):
+    """Retrieve the size in bytes of a file path or in-memory stream (0 if it doesn't exist)."""
+    if hasattr(pdf, 'getbuffer'):
+        return pdf.getbuffer().nbytes
+    elif isinstance(pdf, str) and os.path.isfile(pdf):
+        return os.path.getsize(pdf)
+    return 0
+
+
+class Stages:
+    def __init__(self):
+        """
+        High-resolution timers for named stages.
+
+        Stages may be nested, time spent in a nested stage is only counted towards the inner
+        stage so the sum of every stage's seconds is the total time spent in timed stages.
+        """
+        self.stages = {}
+        self._stack = []
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def _record(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes_read': 0, 'bytes_written': 0})
+
+    @contextmanager
+    def time(self, name, read=None):
+        """
+        Time a block of code as a stage.
+
+        :param name: Stage name
+        :param read: File path or stream read by the stage, its size is added to bytes_read
+        :return: Stage record, bytes_written may be added to it within the block
+        """
+        record = self._record(name)
+        record['bytes_read'] += file_size(read) if read is not None else 0
+        self._stack.append(0.0)
+        start = perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = perf_counter() - start
+            nested = self._stack.pop()
+            record['seconds'] += elapsed - nested
+            record['calls'] += 1
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def add(self, name, seconds=0.0, read=None, written=None):
+        """Add time, or the size of files read or written, to a stage without timing a block of code."""
+        record = self._record(name)
+        record['seconds'] += seconds
+        record['bytes_read'] += file_size(read) if read is not None else 0
+        record['bytes_written'] += file_size(written) if written is not None else 0
+        return record
+
+    @property
+    def total(self):
+        return sum(record['seconds'] for record in self.stages.values())
+
+    def as_dict(self):
+        """Retrieve a copy of every stage's record, in the order stages were first timed."""
+        return {name: dict(record) for name, record in self.stages.items()}
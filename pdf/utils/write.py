@@ -19,15 +19,14 @@ def overlay_pdfs(top_pdf, bottom_pdf, destination):
     output.addPage(page)
 
     # finally, write "output" to a real file
-    with open(destination, "wb") as outputStream:
-        output.write(outputStream)
+    pypdf3_write(output, destination)
 
 
 def write_pdf(pdf_obj, destination):
     """
     Write PDF object to file
     :param pdf_obj: PDF object to be written to file
-    :param destination: Desintation path
+    :param destination: Desintation path or writable stream
     """
     reader = PdfFileReader(pdf_obj)  # Create new PDF object
     writer = PdfFileWriter()
@@ -40,5 +39,20 @@ def write_pdf(pdf_obj, destination):
         writer.addPage(page)
 
     # finally, write "output" to a real file
-    with open(destination, "wb") as outputStream:
-        writer.write(outputStream)
+    return pypdf3_write(writer, destination)
+
+
+def pypdf3_write(writer, destination, **kwargs):
+    """
+    Write a PdfFileWriter object to a file path or an in-memory stream
+    :param writer: PdfFileWriter object
+    :param destination: Destination path or writable stream (ex: io.BytesIO)
+    :return: Destination
+    """
+    if hasattr(destination, 'write'):
+        writer.write(destination, **kwargs)
+        destination.seek(0)
+    else:
+        with open(destination, "wb") as outputStream:
+            writer.write(outputStream, **kwargs)
+    return destination
@@ -3,9 +3,9 @@ __all__ = []
 
 # Conduit installation
 try:
-    from pdf.conduit import Encrypt, Watermark, Label, WatermarkAdd
+    from pdf.conduit import Encrypt, Watermark, Label, WatermarkAdd, WatermarkCache
     CONDUIT_INSTALL = True
-    __all__.extend(["Encrypt", "Watermark", "Label", "WatermarkAdd"])
+    __all__.extend(["Encrypt", "Watermark", "Label", "WatermarkAdd", "WatermarkCache"])
 except ImportError:
     CONDUIT_INSTALL = False
 
@@ -30,17 +30,17 @@ except ImportError:
 
 # Transform installation
 try:
-    from pdf.transform import upscale, rotate, slicer, Merge
+    from pdf.transform import upscale, rotate, slicer, split, Merge, update_metadata, normalize_orientation
     MODIFY_INSTALLED = True
-    __all__.extend(["slicer", "upscale", "rotate", "Merge"])
+    __all__.extend(["slicer", "split", "upscale", "rotate", "Merge", "update_metadata", "normalize_orientation"])
 except ImportError:
     MODIFY_INSTALLED = False
 
 
 # Convert installation
 try:
-    from pdf.convert import Flatten
+    from pdf.convert import Flatten, RenderCache
     CONVERT_INSTALLED = True
-    __all__.extend(["Flatten"])
+    __all__.extend(["Flatten", "RenderCache"])
 except ImportError:
     CONVERT_INSTALLED = False
@@ -0,0 +1,25 @@
+import unittest
+
+from looptools import Timer
+
+from pdf.bench import benchmark, OPERATIONS
+from tests import *
+
+
+class TestBenchmark(unittest.TestCase):
+    @Timer.decorator
+    def test_benchmark(self):
+        """Benchmark operations across methods for a test document and a synthetic document."""
+        operations = ['rotate', 'merge']
+        report = benchmark(documents=[pdf_path], pages=[3], operations=operations, isolate=False)
+
+        # Assert one result per operation, method and document
+        self.assertEqual(len(report['results']), sum(len(OPERATIONS[o]) for o in operations) * 2)
+        for result in report['results']:
+            self.assertNotIn('error', result)
+            self.assertGreater(result['pages_per_second'], 0)
+            self.assertGreater(result['output_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
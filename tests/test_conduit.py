@@ -1,10 +1,15 @@
 import os
+import tempfile
 import unittest
+from io import BytesIO
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import mock
 
+import fitz
 from looptools import Timer
 
-from pdfconduit import Encrypt, Info, Watermark, Label
+from pdfconduit import Encrypt, Info, Watermark, WatermarkAdd, WatermarkCache, Label
+from pdf.conduit import watermark_batch, encrypt_recipients
 from tests import *
 
 
@@ -97,6 +102,95 @@ class TestConduitEncrypt(unittest.TestCase):
         # Assert pdf security value is -1500
         self.assertEqual(security['/P'], -1500)
 
+    @Timer.decorator
+    def test_encrypt_in_memory(self):
+        """Encrypt an in-memory PDF stream and return an in-memory stream."""
+        with open(self.pdf_path, 'rb') as f:
+            encrypted = Encrypt(BytesIO(f.read()), self.user_pw, self.owner_pw, in_memory=True)
+
+        # Assert encrypted pdf was not written to a file
+        self.assertIsInstance(encrypted.file, BytesIO)
+
+        # Assert that pdf stream is now encrypted
+        self.assertTrue(Info(encrypted.file, self.user_pw).encrypted)
+        self.assertEqual(Info(encrypted.file, self.user_pw).pages, Info(self.pdf_path).pages)
+
+    @Timer.decorator
+    def test_encrypt_fitz(self):
+        """Encrypt a PDF file with RC4 using the `fitz` method."""
+        encrypted = Encrypt(self.pdf_path, self.user_pw, self.owner_pw, output=self.temp.name, method='fitz')
+        security = Info(encrypted.output, self.user_pw).pdf.trailer['/Encrypt']
+
+        # Assert that pdf file is encrypted with the same settings as the `pypdf3` method
+        self.assertTrue(Info(encrypted.output, self.user_pw).encrypted)
+        self.assertEqual(security['/Length'], 128)
+        self.assertEqual(security['/P'], -1852)
+
+    @Timer.decorator
+    def test_encrypt_aes(self):
+        """Encrypt PDF file with AES-128 and AES-256 encryption."""
+        for algorithm, encryption in (('aes-128', '128-bit AES'), ('aes-256', '256-bit AES')):
+            encrypted = Encrypt(self.pdf_path, self.user_pw, self.owner_pw, output=self.temp.name,
+                                algorithm=algorithm)
+            doc = fitz.open(encrypted.output)
+
+            # Assert that pdf file requires a password and is encrypted with AES
+            self.assertTrue(doc.needsPass)
+            self.assertTrue(doc.authenticate(self.user_pw))
+            self.assertEqual(doc.pageCount, Info(self.pdf_path).pages)
+            self.assertTrue(doc.metadata['encryption'].endswith(encryption))
+            doc.close()
+
+    @Timer.decorator
+    def test_encrypt_clone(self):
+        """Encrypt a PDF file by cloning its document root and preserve its outline."""
+        toc = [[1, 'First', 1], [2, 'Second', 2], [1, 'Last', Info(self.pdf_path).pages]]
+        with NamedTemporaryFile(suffix='.pdf') as outlined:
+            doc = fitz.open(self.pdf_path)
+            doc.setToC(toc)
+            doc.save(outlined.name)
+            doc.close()
+
+            encrypted = Encrypt(outlined.name, self.user_pw, self.owner_pw, output=self.temp.name, clone=True)
+
+        # Assert that pdf file is encrypted and every page and outline item was copied
+        self.assertTrue(Info(encrypted.output, self.user_pw).encrypted)
+        self.assertEqual(Info(encrypted.output, self.user_pw).pages, Info(self.pdf_path).pages)
+        doc = fitz.open(encrypted.output)
+        self.assertTrue(doc.authenticate(self.user_pw))
+        self.assertEqual(doc.getToC(), toc)
+        doc.close()
+
+    @Timer.decorator
+    def test_encrypt_recipients(self):
+        """Encrypt a PDF file for many recipients from a single parse."""
+        recipients = [('user1', self.owner_pw), ('user2', self.owner_pw, True, True), {'user_pw': 'user3'}]
+        with TemporaryDirectory() as temp:
+            for method, jobs in (('fitz', 1), ('pypdf3', 1), ('fitz', 2)):
+                encrypted = encrypt_recipients(self.pdf_path, recipients, output_dir=temp, method=method, jobs=jobs)
+
+                # Assert one encrypted file per recipient that opens with the recipient's password
+                self.assertEqual(len(encrypted), len(recipients))
+                for number, pdf in enumerate(encrypted, 1):
+                    self.assertTrue(os.path.exists(pdf))
+                    self.assertEqual(Info(pdf, 'user' + str(number)).pages, Info(self.pdf_path).pages)
+
+                # Assert recipient permissions were applied
+                security = Info(encrypted[0], 'user1').pdf.trailer['/Encrypt']
+                self.assertEqual(security['/P'], -1852)
+
+    @Timer.decorator
+    def test_encrypt_recipients_pypdf3_size(self):
+        """Encrypt a PDF file for many recipients with PyPDF3 without accumulating stale objects."""
+        recipients = [('user' + str(number), self.owner_pw) for number in range(1, 6)]
+        for clone in (False, True):
+            encrypted = encrypt_recipients(self.pdf_path, recipients, method='pypdf3', in_memory=True, clone=clone)
+
+            # Assert every recipient's document is the same size and opens with the recipient's password
+            self.assertEqual(len({len(pdf.getvalue()) for pdf in encrypted}), 1)
+            for number, pdf in enumerate(encrypted, 1):
+                self.assertEqual(Info(pdf, 'user' + str(number)).pages, Info(self.pdf_path).pages)
+
 
 class TestConduitWatermark(unittest.TestCase):
     @classmethod
@@ -201,6 +295,241 @@ class TestConduitWatermark(unittest.TestCase):
         self.assertTrue(Info(added).resources())
         return added
 
+    @Timer.decorator
+    def test_conduit_watermark_fitz(self):
+        """Apply a watermark to all pages of PDF using the `fitz` (PyMuPDF) method."""
+        w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        added = w.add(self.pdf_path, wtrmrk, method='fitz', suffix=None)
+        under = w.add(self.pdf_path, wtrmrk, underneath=True, method='fitz', suffix=None)
+
+        # Assert watermarked PDF files exist
+        self.assertTrue(os.path.exists(added))
+        self.assertTrue(os.path.exists(under))
+
+        # Assert watermarked PDF has the same pages and page sizes
+        self.assertEqual(Info(added).pages, Info(self.pdf_path).pages)
+        self.assertEqual(Info(under).size, Info(self.pdf_path).size)
+        return added
+
+    @Timer.decorator
+    def test_conduit_watermark_stream(self):
+        """Apply a watermark to all pages of PDF using the bounded memory `stream` method."""
+        w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        added = WatermarkAdd(self.pdf_path, wtrmrk, output=os.path.join(self.temp.name, 'stream.pdf'),
+                             method='stream', chunk_size=2).file
+        under = w.add(self.pdf_path, wtrmrk, underneath=True, method='stream', suffix=None, max_memory=1)
+
+        # Assert watermarked PDF has the same pages and page sizes
+        self.assertEqual(Info(added).pages, Info(self.pdf_path).pages)
+        self.assertEqual(Info(added).size, Info(self.pdf_path).size)
+        self.assertEqual(Info(under).pages, Info(self.pdf_path).pages)
+
+        # Assert watermark was added to page resources
+        self.assertIn('/PdfConduitWatermark', Info(added).resources()[0]['/Resources']['/XObject'])
+        return added
+
+    @Timer.decorator
+    def test_conduit_watermark_stream_metadata(self):
+        """Keep document information, outlines and forms when watermarking with the `stream` method."""
+        source = os.path.join(self.temp.name, 'metadata.pdf')
+        doc = fitz.open(self.pdf_path)
+        doc.setMetadata({'title': 'Plans', 'author': 'HPA Design'})
+        doc.setToC([[1, 'Plans', 1], [1, 'Details', 2]])
+        widget = fitz.Widget()
+        widget.field_name = 'approved'
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.rect = fitz.Rect(50, 50, 200, 80)
+        doc[0].addWidget(widget)
+        doc.save(source)
+        doc.close()
+
+        w = Watermark(source, use_receipt=False, open_file=False, tempdir=self.temp.name)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        added = WatermarkAdd(source, wtrmrk, output=os.path.join(self.temp.name, 'stream_metadata.pdf'),
+                             method='stream').file
+
+        # Assert metadata, outlines and form fields survived
+        doc = fitz.open(added)
+        self.assertEqual((doc.metadata['title'], doc.metadata['author']), ('Plans', 'HPA Design'))
+        self.assertEqual(doc.getToC(), [[1, 'Plans', 1], [1, 'Details', 2]])
+        self.assertEqual([widget.field_name for widget in doc[0].widgets()], ['approved'])
+        doc.close()
+
+    @Timer.decorator
+    def test_conduit_watermark_rotated_pages(self):
+        """Fit a watermark to pages as they're displayed when pages have a /Rotate."""
+        source = os.path.join(self.temp.name, 'rotated.pdf')
+        doc, original = fitz.open(), fitz.open(self.pdf_path)
+        for rotation in (0, 90, 180, 270):
+            doc.insertPDF(original, from_page=0, to_page=0)
+            doc[-1].setRotation(rotation)
+        doc.save(source)
+        doc.close()
+        original.close()
+
+        w = Watermark(source, use_receipt=False, open_file=False, tempdir=self.temp.name)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=0)
+        for method in ('pdfrw', 'pypdf3', 'stream', 'fitz'):
+            for underneath in (False, True):
+                added = WatermarkAdd(source, wtrmrk, output=os.path.join(self.temp.name, method + '.pdf'),
+                                     method=method, underneath=underneath).file
+
+                # Watermark text direction and position as the pages are displayed
+                doc = fitz.open(added)
+                placed = []
+                for page in doc:
+                    m = page.rotation_matrix
+                    line = next(line for block in page.getText('dict')['blocks'] for line in block.get('lines', [])
+                                if self.address in ''.join(span['text'] for span in line['spans']))
+                    direction = fitz.Point(line['dir']) * m - fitz.Point(0, 0) * m
+                    placed.append(((round(direction.x), round(direction.y)),
+                                   tuple(round(x) for x in fitz.Rect(line['bbox']) * m)))
+                doc.close()
+
+                # Assert upside down pages are watermarked like upright pages and pages rotated either
+                # way are watermarked alike, with the watermark turned to fit the displayed landscape page
+                self.assertEqual(placed[0][0], (1, 0))
+                self.assertEqual(placed[2], placed[0])
+                self.assertEqual(placed[3], placed[1])
+                self.assertEqual(placed[1][0], (0, 1))
+
+    @Timer.decorator
+    def test_conduit_watermark_matrix_placement(self):
+        """Place a watermark by transformation matrix without writing intermediate files."""
+        for method in ('pdfrw', 'pypdf3', 'fitz'):
+            w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name)
+            wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+            temps = set(os.listdir(self.temp.name))
+            wa = WatermarkAdd(self.pdf_path, wtrmrk, output=os.path.join(self.temp.name, method + '.pdf'),
+                              method=method)
+
+            # Assert only the watermarked document was written
+            self.assertEqual(set(os.listdir(self.temp.name)) - temps, {method + '.pdf'})
+
+            # Assert document pages were not resized
+            self.assertEqual(Info(wa.file).size, Info(self.pdf_path).size)
+            self.assertEqual(Info(wa.file).pages, Info(self.pdf_path).pages)
+
+    @Timer.decorator
+    def test_conduit_watermark_in_memory(self):
+        """Watermark and encrypt a PDF without writing any intermediate files."""
+        with open(self.pdf_path, 'rb') as f:
+            w = Watermark(f.read(), use_receipt=False, open_file=False, in_memory=True)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        added = w.add()
+        secured = w.encrypt(self.user_pw, self.owner_pw)
+        w.cleanup()
+
+        # Assert no temporary directory was created
+        self.assertIsNone(w.tempdir)
+
+        # Assert watermark, watermarked and secured PDFs are in-memory streams
+        self.assertIsInstance(wtrmrk, BytesIO)
+        self.assertIsInstance(added, BytesIO)
+        self.assertIsInstance(secured, BytesIO)
+
+        # Assert watermarked PDF has the same number of pages
+        self.assertEqual(Info(added).pages, Info(self.pdf_path).pages)
+        self.assertTrue(Info(secured, self.user_pw).encrypted)
+        return added
+
+    @Timer.decorator
+    def test_conduit_watermark_in_memory_flatten(self):
+        """Draw a flattened image watermark without creating any temporary files."""
+        with open(self.pdf_path, 'rb') as f:
+            w = Watermark(f.read(), use_receipt=False, open_file=False, in_memory=True)
+        with mock.patch.object(tempfile, 'mkdtemp', wraps=tempfile.mkdtemp) as mkdtemp, \
+                mock.patch.object(tempfile, '_mkstemp_inner', wraps=tempfile._mkstemp_inner) as mkstemp:
+            wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, flatten=True)
+
+        # Assert no temporary file or directory was created
+        self.assertFalse(mkdtemp.called)
+        self.assertFalse(mkstemp.called)
+        self.assertIsInstance(wtrmrk, BytesIO)
+
+    @Timer.decorator
+    def test_conduit_watermark_add_and_encrypt(self):
+        """Watermark and encrypt a PDF in a single read and write."""
+        for method in ('pypdf3', 'fitz'):
+            w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name)
+            w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+            secured = w.add_and_encrypt(self.user_pw, self.owner_pw, method=method,
+                                        output=os.path.join(self.temp.name, method + '.pdf'))
+            security = Info(secured, self.user_pw).pdf.trailer['/Encrypt']
+
+            # Assert the document was encrypted with 128 bit keys and print only permissions
+            self.assertTrue(Info(secured, self.user_pw).encrypted)
+            self.assertEqual(security['/Length'], 128)
+            self.assertEqual(security['/P'], -1852)
+            self.assertEqual(Info(secured, self.user_pw).pages, Info(self.pdf_path).pages)
+
+    @Timer.decorator
+    def test_conduit_watermark_timings(self):
+        """Record the time and bytes read/written by each watermarking stage."""
+        w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name)
+        w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        added = w.add(self.pdf_path, suffix=None)
+        secured = w.encrypt(self.user_pw, self.owner_pw, output=os.path.join(self.temp.name, 'secured.pdf'))
+        timings = w.timings
+
+        # Assert every stage was timed
+        for stage in ('document info', 'canvas', 'draw', 'watermark write', 'merge', 'write', 'encrypt'):
+            self.assertIn(stage, timings)
+            self.assertGreaterEqual(timings[stage]['seconds'], 0)
+
+        # Assert bytes written match the output files
+        self.assertEqual(timings['write']['bytes_written'], os.path.getsize(added))
+        self.assertEqual(timings['encrypt']['bytes_written'], os.path.getsize(secured))
+        self.assertEqual(timings['merge']['bytes_read'], os.path.getsize(self.pdf_path))
+
+    @Timer.decorator
+    def test_conduit_watermark_cache(self):
+        """Reuse a rendered watermark when drawing parameters are identical."""
+        cache = WatermarkCache(directory=os.path.join(self.temp.name, 'cache'))
+        w = Watermark(self.pdf_path, use_receipt=False, open_file=False, tempdir=self.temp.name, cache=cache)
+        first = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        second = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.1, rotate=self.rotate)
+
+        # Assert only distinct drawing parameters were rendered and cached
+        self.assertEqual(len(cache), 2)
+
+        # Assert cached watermark is identical to the rendered watermark
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        # Assert on-disk store is shared with a new cache instance
+        shared = WatermarkCache(directory=cache.directory)
+        w = Watermark(self.pdf_path, use_receipt=False, open_file=False, in_memory=True, cache=shared)
+        wtrmrk = w.draw(self.address, str(self.town + ', ' + self.state), opacity=0.08, rotate=self.rotate)
+        with open(first, 'rb') as f:
+            self.assertEqual(wtrmrk.getvalue(), f.read())
+        return second
+
+    @Timer.decorator
+    def test_conduit_watermark_batch(self):
+        """Watermark multiple PDF files in parallel and report errors per document."""
+        documents = [self.pdf_path, os.path.join(test_data_dir, 'plan_p.pdf'), os.path.join(test_data_dir, 'plan_l.pdf'),
+                     os.path.join(test_data_dir, 'missing.pdf')]
+        results = watermark_batch(documents, jobs=2, output_dir=self.temp.name, text1=self.address,
+                                  text2=str(self.town + ', ' + self.state), rotate=self.rotate)
+
+        # Assert results are in the same order as documents
+        self.assertEqual([r['document'] for r in results], documents)
+
+        # Assert readable documents were watermarked
+        for doc, result in zip(documents[:-1], results[:-1]):
+            self.assertIsNone(result['error'])
+            self.assertTrue(os.path.exists(result['output']))
+            self.assertEqual(Info(result['output']).pages, Info(doc).pages)
+
+        # Assert unreadable document was reported as an error
+        self.assertIsNone(results[-1]['output'])
+        self.assertIsNotNone(results[-1]['error'])
+        return results
+
     @Timer.decorator
     def test_conduit_watermark_label(self):
         """Apply a watermark label to a PDF file."""
@@ -1,10 +1,13 @@
 import os
 import unittest
 from tempfile import TemporaryDirectory
+from unittest import mock
 
 from looptools import Timer
+from PIL import Image
 
-from pdf.convert import IMG2PDF, PDF2IMG
+from pdf.convert import IMG2PDF, PDF2IMG, RenderCache
+from pdf.convert.pdf2img import _render_pages
 from pdfconduit import Info, Flatten
 from tests import *
 
@@ -81,7 +84,7 @@ class TestConvertPdf2Img(unittest.TestCase):
         cls.img = None
 
     def tearDown(self):
-        if os.path.exists(self.img):
+        if self.img and os.path.exists(self.img):
             os.remove(self.img)
 
     @Timer.decorator
@@ -97,6 +100,135 @@ class TestConvertPdf2Img(unittest.TestCase):
         self.img = img[0]
         return img[0]
 
+    @Timer.decorator
+    def test_pdf2img_formats(self):
+        """Convert a PDF file to JPEG, WebP and TIFF images without a PNG round trip."""
+        with TemporaryDirectory() as temp:
+            for ext, image_format, options in (('png', 'PNG', {}), ('jpg', 'JPEG', {'quality': 80}),
+                                               ('webp', 'WEBP', {'quality': 80}),
+                                               ('tiff', 'TIFF', {'compression': 'tiff_lzw'})):
+                img = PDF2IMG(self.pdf_path, tempdir=temp, ext=ext, **options).save()
+
+                # Assert img file is the correct file type
+                self.assertTrue(img[0].endswith('.' + ext))
+                with Image.open(img[0]) as image:
+                    self.assertEqual(image.format, image_format)
+
+    @Timer.decorator
+    def test_pdf2img_iter_pages(self):
+        """Render the pages of a PDF file one page at a time."""
+        pdf = os.path.join(test_data_dir, 'document.pdf')
+        pdf2img = PDF2IMG(pdf)
+        pages = pdf2img.iter_pages()
+
+        # Assert pages are rendered lazily without holding every page's image
+        self.assertFalse(isinstance(pages, list))
+        self.assertTrue(next(pages).startswith(b'\x89PNG'))
+        self.assertEqual(sum(1 for _ in pages) + 1, Info(pdf).pages)
+        self.assertIsNone(pdf2img._page_data)
+        self.assertTrue(all(dlist is None for dlist in pdf2img.dlist_tab))
+
+    @Timer.decorator
+    def test_pdf2img_jobs(self):
+        """Convert the pages of a PDF file to png images in worker processes."""
+        pdf = os.path.join(test_data_dir, 'document.pdf')
+        sequential = PDF2IMG(pdf).pdf_data
+        parallel = PDF2IMG(pdf, jobs=2).pdf_data
+
+        # Assert every page was rendered and reassembled in page order
+        self.assertEqual(len(parallel), Info(pdf).pages)
+        self.assertEqual(parallel, sequential)
+
+    @Timer.decorator
+    def test_pdf2img_tiles(self):
+        """Render a page at 300 dpi as fixed-size tiles matching the full page render."""
+        pdf = os.path.join(test_data_dir, 'plan_l.pdf')
+        pdf2img = PDF2IMG(pdf, dpi=300)
+        page = pdf2img._get_pixmap(0)
+        tiles = list(pdf2img.iter_tiles(0, tile_size=512))
+
+        # Assert the page was rendered at 300 dpi and tiles are no larger than tile_size
+        self.assertEqual((page.width, page.height), (round(528 * 300 / 72), round(408 * 300 / 72)))
+        self.assertTrue(all(pix.width <= 512 and pix.height <= 512 for row, col, pix in tiles))
+        self.assertEqual(sum(pix.width * pix.height for row, col, pix in tiles), page.width * page.height)
+
+        # Assert each tile has the same pixels as its crop of the page
+        n = page.n
+        for row, col, pix in tiles:
+            x, y = col * 512, row * 512
+            for j in range(pix.height):
+                start = ((y + j) * page.width + x) * n
+                self.assertEqual(page.samples[start:start + pix.width * n],
+                                 pix.samples[j * pix.width * n:(j + 1) * pix.width * n])
+
+        with TemporaryDirectory() as temp:
+            saved = PDF2IMG(pdf, tempdir=temp, dpi=300, jobs=2).save_tiles(tile_size=1024)
+
+            # Assert a tile image was saved for each tile
+            self.assertEqual(len(saved), 6)
+            self.assertTrue(all(os.path.exists(tile) for tile in saved))
+
+    @Timer.decorator
+    def test_pdf2img_cache(self):
+        """Reuse page images rendered with the same document contents and settings."""
+        pdf = os.path.join(test_data_dir, 'document.pdf')
+        with TemporaryDirectory() as temp:
+            cache = RenderCache(os.path.join(temp, 'cache'))
+            rendered = PDF2IMG(pdf, cache=cache).pdf_data
+
+            # Assert every page was cached
+            self.assertEqual(len(cache), Info(pdf).pages)
+
+            # Assert cache hits skip display list creation and return the rendered images
+            pdf2img = PDF2IMG(pdf, cache=cache)
+            self.assertEqual(pdf2img.pdf_data, rendered)
+            self.assertTrue(all(dlist is None for dlist in pdf2img.dlist_tab))
+
+            # Assert other settings are cached separately
+            PDF2IMG(pdf, cache=cache, dpi=36).pdf_data
+            self.assertEqual(len(cache), Info(pdf).pages * 2)
+
+            # Assert least recently used images are evicted to stay under the size cap
+            small = RenderCache(os.path.join(temp, 'small'), maxsize=max(len(img) for img in rendered) * 2)
+            PDF2IMG(pdf, cache=small).pdf_data
+            self.assertTrue(sum(os.path.getsize(path) for path in small._entries()) <= small.maxsize)
+            self.assertLess(len(small), Info(pdf).pages)
+
+            # Assert worker jobs use the cache keys computed by the parent instead of hashing the document
+            keys = [PDF2IMG(pdf, cache=cache)._cache_key(pno) for pno in range(2)]
+            with mock.patch.object(RenderCache, '_file_digest', side_effect=AssertionError('document hashed')):
+                data = _render_pages((pdf, range(2), False, None, {'cache': cache}, keys))
+            self.assertEqual(data, rendered[:2])
+
+    @Timer.decorator
+    def test_pdf2img_pyramid(self):
+        """Render a page's DeepZoom and XYZ tile pyramids from a single display list."""
+        pdf = os.path.join(test_data_dir, 'plan_l.pdf')
+        pdf2img = PDF2IMG(pdf, dpi=150)
+        levels = {level: (width, height) for level, width, height in pdf2img.pyramid_levels(0, 256)}
+
+        # Assert levels halve down to a single pixel and the last level is the full resolution
+        self.assertEqual(levels[0], (1, 1))
+        self.assertEqual(levels[max(levels)], (round(528 * 150 / 72), round(408 * 150 / 72)))
+
+        # Assert tiles cover every level exactly, with overlap pixels shared by neighbouring tiles
+        for level, row, col, pix in pdf2img.pyramid(0, tile_size=256, overlap=1):
+            width, height = levels[level]
+            self.assertEqual(pix.width, min(col * 256 + 257, width) - max(col * 256 - 1, 0))
+            self.assertEqual(pix.height, min(row * 256 + 257, height) - max(row * 256 - 1, 0))
+        self.assertEqual(sum(dlist is not None for dlist in pdf2img.dlist_tab), 1)
+
+        # Assert XYZ pyramids start at the level that fits in one tile
+        xyz = pdf2img.pyramid_levels(0, 256, layout='xyz')
+        self.assertTrue(max(xyz[0][1:]) <= 256 < max(xyz[1][1:]))
+
+        with TemporaryDirectory() as temp:
+            dzi = PDF2IMG(pdf, tempdir=temp).save_pyramid(0, tile_size=256)
+
+            # Assert the DeepZoom descriptor and the full resolution tiles were saved
+            self.assertTrue(os.path.exists(dzi))
+            self.assertTrue(os.path.exists(os.path.join(temp, 'plan_l_1_files', '10', '1_1.png')))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,15 @@
 import os
+import shutil
 import unittest
 from tempfile import TemporaryDirectory
+from unittest import mock
 
+import fitz
 from looptools import Timer
+from reportlab.lib.pagesizes import letter
 
-from pdfconduit import Info, Merge, upscale, slicer, rotate
+from pdfconduit import Info, Merge, upscale, slicer, split, rotate, update_metadata, normalize_orientation
+from pdf.transform.orientation import page_geometry, misoriented
 from tests import *
 
 
@@ -43,6 +48,72 @@ class TestTransformMerge(unittest.TestCase):
         self.assertEqual(sum([Info(pdf).pages for pdf in self.pdfs]), Info(merged.file).pages)
         return merged
 
+    @Timer.decorator
+    def test_merge_stream(self):
+        """Merge a generator of PDF files by streaming each file's pages to the output."""
+        merged = Merge((pdf for pdf in self.pdfs), output_name='merged_stream', output_dir=self.temp.name,
+                       method='stream')
+
+        # Assert merged file exists
+        self.assertTrue(os.path.exists(merged.file))
+
+        # Assert sum of pages in original pdf files equals sum of pages in merged pdf
+        self.assertEqual(sum([Info(pdf).pages for pdf in self.pdfs]), Info(merged.file).pages)
+        self.assertEqual(Info(merged.file).metadata['/Title'], 'HPA Design')
+        return merged
+
+    @Timer.decorator
+    def test_merge_jobs(self):
+        """Merge PDF files parsed in worker processes in their original order."""
+        merged = Merge(self.pdfs, output_name='merged_stream', output_dir=self.temp.name, method='stream')
+        parallel = Merge(self.pdfs, output_name='merged_jobs', output_dir=self.temp.name, jobs=2)
+
+        # Assert parallel parsing writes the same document as sequential streaming
+        self.assertEqual(parallel.method, 'stream')
+        self.assertEqual(sum([Info(pdf).pages for pdf in self.pdfs]), Info(parallel.file).pages)
+        with open(merged.file, 'rb') as m, open(parallel.file, 'rb') as p:
+            self.assertEqual(m.read(), p.read())
+
+    @Timer.decorator
+    def test_merge_empty(self):
+        """Refuse to merge an empty generator of PDF files."""
+        # Assert a ValueError is raised rather than StopIteration
+        with self.assertRaisesRegex(ValueError, 'No PDF files to merge'):
+            Merge((pdf for pdf in []), method='stream')
+        with self.assertRaisesRegex(ValueError, 'No PDF files to merge'):
+            Merge([])
+
+    @Timer.decorator
+    def test_merge_relative_generator(self):
+        """Merge a generator of relative PDF paths into the current directory."""
+        for pdf in self.pdfs:
+            shutil.copy(pdf, self.temp.name)
+        cwd = os.getcwd()
+        os.chdir(self.temp.name)
+        try:
+            merged = Merge((os.path.basename(pdf) for pdf in self.pdfs), output_name='merged_relative',
+                           method='stream')
+        finally:
+            os.chdir(cwd)
+
+        # Assert the output was written next to the relative inputs
+        self.assertEqual(merged.file, 'merged_relative.pdf')
+        self.assertEqual(sum([Info(pdf).pages for pdf in self.pdfs]),
+                         Info(os.path.join(self.temp.name, merged.file)).pages)
+
+    @Timer.decorator
+    def test_merge_dedup(self):
+        """Merge copies of a PDF file and share their identical fonts and images."""
+        pdfs = [self.pdfs[2]] * 3
+        for method in ('pdfrw', 'pypdf3', 'stream'):
+            merged = Merge(pdfs, output_name='merged_' + method, output_dir=self.temp.name, method=method)
+            deduped = Merge(pdfs, output_name='deduped_' + method, output_dir=self.temp.name, method=method,
+                            dedup=True)
+
+            # Assert every page was merged and duplicate resources were only written once
+            self.assertEqual(Info(deduped.file).pages, Info(merged.file).pages)
+            self.assertLess(os.path.getsize(deduped.file), os.path.getsize(merged.file) / 2)
+
 
 class TestTransformUpscale(unittest.TestCase):
     @classmethod
@@ -107,6 +178,47 @@ class TestTransformUpscale(unittest.TestCase):
         return upscaled
 
 
+    @Timer.decorator
+    def test_upscale_fit_letter(self):
+        """Fit every page of a PDF file with mixed page sizes to letter size."""
+        pdfs = [os.path.join(test_data_dir, p) for p in ['plan_l.pdf', 'plan_p.pdf', 'document.pdf']]
+        mixed = Merge(pdfs, output_name='mixed', output_dir=self.temp.name).file
+        fitted = upscale(mixed, size=letter, suffix='letter', tempdir=self.temp.name)
+
+        # Assert every page is letter size in its original orientation
+        reader = Info(fitted).pdf
+        self.assertEqual(reader.getNumPages(), Info(mixed).pages)
+        for page_number in range(reader.getNumPages()):
+            width, height = (float(x) for x in reader.getPage(page_number).mediaBox[2:])
+            self.assertEqual((width, height), letter if height > width else letter[::-1])
+
+    @Timer.decorator
+    def test_upscale_fit_links(self):
+        """Move link annotations with the page's contents when fitting pages."""
+        linked = os.path.join(self.temp.name, 'links.pdf')
+        doc = fitz.open(pdf_path)
+        doc[0].insertLink({'kind': fitz.LINK_URI, 'from': fitz.Rect(100, 100, 200, 120), 'uri': 'https://example.com'})
+        doc[1].insertLink({'kind': fitz.LINK_GOTO, 'from': fitz.Rect(50, 700, 150, 720), 'page': 0})
+        doc.save(linked)
+        doc.close()
+        upscaled = upscale(linked, scale=2.0, suffix='links', tempdir=self.temp.name, method='fit')
+
+        # Assert link rectangles were scaled with the pages
+        doc = fitz.open(upscaled)
+        self.assertIn(fitz.Rect(200, 200, 400, 240), [link['from'] for link in doc[0].getLinks()])
+        self.assertIn(fitz.Rect(100, 1400, 300, 1440), [link['from'] for link in doc[1].getLinks()])
+        doc.close()
+
+    @Timer.decorator
+    def test_upscale_fit_20x(self):
+        """Resize each page of a PDF file to 2.0x times its own size."""
+        s = 2.0
+        upscaled = upscale(pdf_path, scale=s, suffix='upscaled_2.0_fit', tempdir=self.temp.name, method='fit')
+
+        # Assert upscaled pdf file is the correct size
+        self.assertEqual(Info(upscaled).size, tuple([i * s for i in Info(pdf_path).size]))
+
+
 class TestTransformSlice(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -147,6 +259,35 @@ class TestTransformSlice(unittest.TestCase):
         return sliced
 
 
+    @Timer.decorator
+    def test_split(self):
+        """Split a PDF file into many page ranges from a single parse."""
+        pages = Info(self.pdf_path).pages
+        ranges = [(1, 2), (4, 7), (pages, pages)]
+        for options in ({'ranges': ranges}, {'every': 3}, {'every': 3, 'jobs': 2}):
+            parts = split(self.pdf_path, output_dir=self.temp.name, **options)
+
+            # Assert every part exists and contains its page range
+            self.assertTrue(all(os.path.isfile(part) for part in parts))
+            if 'ranges' in options:
+                self.assertEqual([Info(part).pages for part in parts], [lp - fp + 1 for fp, lp in ranges])
+            else:
+                self.assertEqual(len(parts), -(-pages // 3))
+                self.assertEqual(sum(Info(part).pages for part in parts), pages)
+
+    @Timer.decorator
+    def test_split_max_size(self):
+        """Split a PDF file into parts no larger than a maximum size."""
+        max_size = os.path.getsize(self.pdf_path) // 3
+        parts = split(self.pdf_path, max_size=max_size, output_dir=self.temp.name)
+
+        # Assert every page was written to a part that isn't larger than the maximum size
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(sum(Info(part).pages for part in parts), Info(self.pdf_path).pages)
+        for part in parts:
+            self.assertTrue(Info(part).pages == 1 or os.path.getsize(part) <= max_size)
+
+
 class TestRotate(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -236,6 +377,107 @@ class TestRotate(unittest.TestCase):
         self.assertEqual(Info(rotated).rotate, rotation)
         return rotated
 
+    @Timer.decorator
+    def test_rotate_incremental_90(self):
+        """Rotate a PDF file by 90 degrees by appending an incremental update."""
+        rotation = 90
+        pdf = shutil.copy(self.pdf_path, self.temp.name)
+        size = os.path.getsize(pdf)
+        rotated = rotate(pdf, rotation, method='incremental', overwrite=True)
+
+        # Assert the original contents were kept and only the updated pages were appended
+        self.assertEqual(rotated, pdf)
+        with open(self.pdf_path, 'rb') as original, open(rotated, 'rb') as updated:
+            self.assertEqual(updated.read(size), original.read())
+        self.assertLess(os.path.getsize(rotated) - size, size / 10)
+
+        # Assert pdf file was rotated by the correct amount of degrees
+        self.assertEqual(Info(rotated).rotate, rotation)
+        self.assertEqual(Info(rotated).pages, Info(self.pdf_path).pages)
+        return rotated
+
+    def test_rotate_incremental_failure(self):
+        """Leave a PDF file unchanged when an incremental update fails part way through."""
+        pdf = shutil.copy(self.pdf_path, self.temp.name)
+        with open(pdf, 'rb') as f:
+            original = f.read()
+
+        with mock.patch('PyPDF3.generic.DictionaryObject.writeToStream', side_effect=IOError('disk full')):
+            with self.assertRaises(IOError):
+                rotate(pdf, 90, method='incremental', overwrite=True)
+
+        # Assert the partial update was discarded
+        with open(pdf, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+
+class TestOrientation(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        pdfs = [os.path.join(test_data_dir, p) for p in ['plan_l.pdf', 'plan_p.pdf', 'plan_l.pdf']]
+        self.mixed = Merge(pdfs, output_name='mixed', output_dir=self.temp.name).file
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def _landscape(self, pdf):
+        reader = Info(pdf).pdf
+        pages = [reader.getPage(i) for i in range(reader.getNumPages())]
+        return [(float(p.mediaBox[2]) > float(p.mediaBox[3])) != (p.get('/Rotate', 0) % 180 == 90) for p in pages]
+
+    @Timer.decorator
+    def test_normalize_orientation(self):
+        """Rotate the pages of a mixed orientation PDF file that don't match most pages."""
+        normalized = normalize_orientation(self.mixed, tempdir=self.temp.name)
+
+        # Assert only the portrait page was rotated
+        self.assertEqual(self._landscape(normalized), [True, True, True])
+        self.assertEqual(Info(normalized).pdf.getPage(0).get('/Rotate', 0), 0)
+
+    @Timer.decorator
+    def test_normalize_orientation_portrait(self):
+        """Rotate the landscape pages of a mixed orientation PDF file to portrait."""
+        for method in ('incremental', 'pdfrw', 'pypdf3'):
+            normalized = normalize_orientation(self.mixed, 'portrait', tempdir=self.temp.name, method=method)
+            self.assertEqual(self._landscape(normalized), [False, False, False])
+
+    def test_misoriented(self):
+        """Classify page geometry by its displayed orientation."""
+        geometry = page_geometry(Info(self.mixed).pdf)
+
+        # Assert geometry is a list of (width, height, rotate) tuples
+        self.assertEqual(geometry, [(528, 408, 0), (612, 792, 0), (528, 408, 0)])
+
+        # Assert rotated pages are classified by their displayed orientation
+        self.assertEqual(misoriented(geometry), [1])
+        self.assertEqual(misoriented(geometry, 'portrait'), [0, 2])
+        self.assertEqual(misoriented([(612, 792, 90), (612, 792, 0), (612, 792, 270)]), [1])
+
+
+class TestMetadata(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pdf_path = pdf_path
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    @Timer.decorator
+    def test_update_metadata(self):
+        """Update a PDF file's document information with an incremental update."""
+        updated = update_metadata(self.pdf_path, {'Title': 'Plans', 'Author': 'HPA Design'}, tempdir=self.temp.name)
+
+        # Assert document information was updated without rewriting the document
+        metadata = Info(updated).metadata
+        self.assertEqual(metadata['/Title'], 'Plans')
+        self.assertEqual(metadata['/Author'], 'HPA Design')
+        self.assertEqual(Info(updated).pages, Info(self.pdf_path).pages)
+        self.assertLess(os.path.getsize(updated) - os.path.getsize(self.pdf_path), 1024)
+        return updated
+
 
 if __name__ == '__main__':
     unittest.main()